@@ -0,0 +1,166 @@
+import numpy as np
+from model import CellState, DIRECTION, FOOD_REWARD, COLLISION_REWARD, STEP_REWARD, get_kernel
+
+OPPOSITE = np.array([DIRECTION.DOWN, DIRECTION.UP, DIRECTION.RIGHT, DIRECTION.LEFT, DIRECTION.STOP],
+                    dtype=np.int64)
+
+
+class BatchEnvironment:
+    """
+    Represents many snake games that are stepped in lockstep. Every board is
+    kept in NumPy arrays: occupancy grid, ring buffer of snake body cells,
+    head pointer, length, food and direction. Cell (x, y) is stored at index
+    y * width + x. Next cells are looked up in the table of the step kernel
+    and its rules are applied to all boards at once. Rewards follow the rules
+    of Environment and boards that end are reset automatically.
+    """
+    def __init__(self, batch_size, board_size, seed=None):
+        """
+        Creates batch of boards in start state.
+        :param batch_size: number of boards.
+        :param board_size: size of a game board.
+        :param seed: seed of random generator used for food spawning.
+        """
+        self.__batch_size = batch_size
+        self.__width = board_size
+        self.__height = board_size
+        self.__cells = board_size * board_size
+        # next cell for every cell and direction, -1 outside of the board
+        self.__moves = np.array(get_kernel(board_size, board_size).moves[:4 * self.__cells],
+                                dtype=np.int64).reshape(self.__cells, 4)
+        self.__random = np.random.default_rng(seed)
+        self.__boards = np.arange(batch_size)
+        self.__occupied = np.zeros((batch_size, self.__cells), dtype=np.uint8)
+        self.__body = np.zeros((batch_size, self.__cells), dtype=np.int64)
+        self.__head_pointer = np.zeros(batch_size, dtype=np.int64)
+        self.__length = np.zeros(batch_size, dtype=np.int64)
+        self.__food = np.zeros(batch_size, dtype=np.int64)
+        self.__direction = np.zeros(batch_size, dtype=np.int64)
+        self.__score = np.zeros(batch_size, dtype=np.int64)
+        self.__final_score = np.zeros(batch_size, dtype=np.int64)
+        self.reset()
+
+    def reset(self, boards=None):
+        """
+        Puts boards to start state, the same as in GameState.
+        :param boards: indexes or mask of boards, all boards if None.
+        """
+        if boards is None:
+            boards = self.__boards
+        boards = self.__boards[boards]
+        if len(boards) == 0:
+            return
+        if self.__width <= 5:
+            x, y = int(self.__width / 2), int(self.__height / 2)
+        else:
+            x, y = int(self.__width / 4), int(self.__height / 4)
+        start = np.array([y * self.__width + x - i for i in range(3)], dtype=np.int64)
+        self.__occupied[boards] = 0
+        self.__occupied[boards[:, None], start[None, :]] = 1
+        self.__body[boards, :3] = start
+        self.__head_pointer[boards] = 0
+        self.__length[boards] = 3
+        self.__direction[boards] = DIRECTION.RIGHT
+        self.__score[boards] = 0
+        self.__spawn_food(boards)
+
+    def step(self, actions):
+        """
+        Moves snakes on all boards one step.
+        :param actions: vector of DIRECTION values, one for every board.
+        :return: observations, rewards and done flags of all boards.
+        """
+        boards = self.__boards
+        actions = np.asarray(actions, dtype=np.int64)
+        # snake can not turn back, the same as Snake.change_direction
+        turn = (actions != DIRECTION.STOP) & (actions != OPPOSITE[self.__direction])
+        self.__direction = np.where(turn, actions, self.__direction)
+
+        head = self.__body[boards, self.__head_pointer]
+        new_head = self.__moves[head, self.__direction]
+        wall = new_head < 0
+        new_head = np.where(wall, 0, new_head)
+        ate = ~wall & (new_head == self.__food)
+
+        # tail moves away before the head moves, unless snake eats food
+        moved = ~ate
+        tail = self.__body[boards, (self.__head_pointer + self.__length - 1) % self.__cells]
+        self.__occupied[boards[moved], tail[moved]] -= 1
+        self.__length -= moved
+
+        collision = wall | (self.__occupied[boards, new_head] > 0)
+        alive = ~collision
+        self.__head_pointer = np.where(alive, (self.__head_pointer - 1) % self.__cells, self.__head_pointer)
+        self.__body[boards[alive], self.__head_pointer[alive]] = new_head[alive]
+        self.__occupied[boards[alive], new_head[alive]] = 1
+        self.__length += alive
+
+        rewards = np.where(ate, FOOD_REWARD, np.where(collision, COLLISION_REWARD, STEP_REWARD))
+        self.__score += ate
+        full = self.__spawn_food(boards[ate & alive])
+        done = collision
+        done[full] = True
+        self.__final_score[done] = self.__score[done]
+        self.reset(done)
+        return self.get_observations(), rewards, done
+
+    def get_observations(self):
+        """
+        Grid of every board with CellState values.
+        :return: array of shape (batch size, height, width), indexed by [board, y, x].
+        """
+        observations = (self.__occupied > 0).astype(np.uint8)
+        observations[self.__boards, self.__food] = CellState.FOOD
+        return observations.reshape(self.__batch_size, self.__height, self.__width)
+
+    def __spawn_food(self, boards):
+        """
+        Chooses uniformly random free cell for food on given boards.
+        :param boards: indexes of boards.
+        :return: indexes of boards that have no free cell left.
+        """
+        if len(boards) == 0:
+            return boards
+        keys = self.__random.random((len(boards), self.__cells))
+        keys[self.__occupied[boards] > 0] = -1
+        cells = keys.argmax(axis=1)
+        self.__food[boards] = cells
+        return boards[keys[np.arange(len(boards)), cells] < 0]
+
+    @property
+    def batch_size(self):
+        return self.__batch_size
+
+    @property
+    def head(self):
+        """
+        Head positions as (x, y) pairs.
+        """
+        head = self.__body[self.__boards, self.__head_pointer]
+        return np.stack((head % self.__width, head // self.__width), axis=1)
+
+    @property
+    def food(self):
+        """
+        Food positions as (x, y) pairs.
+        """
+        return np.stack((self.__food % self.__width, self.__food // self.__width), axis=1)
+
+    @property
+    def direction(self):
+        return self.__direction
+
+    @property
+    def length(self):
+        return self.__length
+
+    @property
+    def score(self):
+        return self.__score
+
+    @property
+    def final_score(self):
+        """
+        Score of every board when its last game ended.
+        """
+        return self.__final_score
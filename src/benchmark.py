@@ -0,0 +1,507 @@
+import getopt
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from model import DELTAS, DIRECTION, GameState, BodyStateEncoder, FeatureStateEncoder, get_kernel
+from monte_carlo_tree_search import Board, StatisticsSink, get_zobrist_keys
+from simulation import ReinforcementAgentsSimulation, get_simulation
+from snake import AGENTS, SIZES, get_agent_options, get_board_size
+
+# boards larger than the playable ones, to see how agents and engine scale
+SYNTHETIC_SIZES = {"XL": 48, "XXL": 64}
+
+# games (episodes for reinforcement agents), maximum steps and agent options
+# of every scenario; searches have fixed budgets, so results do not depend on speed
+BUDGETS = {
+    "RANDOM": (20, 2000, {}),
+    "ZIGZAG": (3, 2000, {}),
+    "SMART": (3, 2000, {}),
+    "OROBORUS": (1, 2000, {}),
+    "Q": (50, 5000, {}),
+    "MC": (1, 50, {"simulations": 200}),
+    "MCQ": (3, 150, {"search_options": {"simulations": 100}}),
+}
+
+# throughput metrics that are sampled in every repeated run and compared
+# with a baseline, higher values are better
+SCENARIO_METRICS = ("steps_per_second", "expansions_per_second", "rollouts_per_second")
+MICRO_METRICS = ("ops_per_second",)
+
+
+class SearchCounter(StatisticsSink):
+    """
+    Counts simulations and duration of all searches.
+    """
+    def __init__(self):
+        self.simulations = 0
+        self.duration = 0.0
+
+    def add(self, statistics):
+        self.simulations += statistics.simulations
+        self.duration += statistics.duration
+
+
+def percentile(values, percent):
+    """
+    :param values: sorted list of values.
+    :param percent: percentile between 0 and 100.
+    :return: nearest-rank percentile, 0 for no values.
+    """
+    if not values:
+        return 0
+    rank = max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def time_decisions(agent, latencies):
+    """
+    Wraps get_next_action of the agent so duration of every decision is recorded.
+    :param agent: agent of a simulation.
+    :param latencies: list that receives durations in nanoseconds.
+    """
+    get_next_action = agent.get_next_action
+
+    def timed_next_action():
+        begin = time.perf_counter_ns()
+        action = get_next_action()
+        latencies.append(time.perf_counter_ns() - begin)
+        return action
+    agent.get_next_action = timed_next_action
+
+
+def play(agent, board_size, games, max_steps, agent_options, seed, workers=1):
+    """
+    Plays seeded headless games of a scenario.
+    :return: scores, number of steps, duration in seconds, decision latencies
+    in nanoseconds, expanded nodes and search counter.
+    """
+    random.seed(seed)
+    options = dict(agent_options)
+    for name, value in get_agent_options(agent, workers).items():
+        options[name] = dict(options.get(name, {}), **value) if isinstance(value, dict) else value
+    counter = SearchCounter()
+    if agent == "MC":
+        options["seed"] = seed
+    if agent in ("MC", "MCQ"):
+        options["sink"] = counter
+    latencies, scores, steps, expanded_nodes, duration = [], [], 0, 0, 0.0
+    if agent in ("Q", "MCQ"):
+        # games are episodes of one learning agent
+        simulation = ReinforcementAgentsSimulation(board_size, agent, games, max_steps, verbose=False,
+                                                   agent_options=options)
+        time_decisions(simulation.agent, latencies)
+        begin = time.perf_counter()
+        try:
+            simulation.train()
+        finally:
+            simulation.close()
+        duration = time.perf_counter() - begin
+        scores = [score for score, _ in simulation.results]
+        steps = simulation.steps
+    else:
+        for _ in range(games):
+            simulation = get_simulation(board_size, agent, max_steps, agent_options=options)
+            time_decisions(simulation.agent, latencies)
+            begin = time.perf_counter()
+            score, game_steps = simulation.run()
+            duration += time.perf_counter() - begin
+            scores.append(score)
+            steps += game_steps
+            expanded_nodes += getattr(simulation.agent, "expanded_nodes", 0)
+    return scores, steps, duration, latencies, expanded_nodes, counter
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def run_scenario(agent, size, board_size, seed, result=None, workers=1):
+    """
+    Plays seeded games of one agent on one board once. Every run adds one
+    sample of each throughput metric, so runs of a scenario can be spread
+    over the whole benchmark.
+    :param agent: name of the agent.
+    :param size: name of the board size.
+    :param board_size: game board size.
+    :param seed: random seed of the games.
+    :param result: result of previous runs of the scenario, None for the first run.
+    :param workers: number of processes of Monte Carlo searches.
+    :return: result with samples of this run.
+    """
+    games, max_steps, agent_options = BUDGETS[agent]
+    scores, steps, duration, latencies, expanded_nodes, counter = play(agent, board_size, games, max_steps,
+                                                                       agent_options, seed, workers)
+    if result is None:
+        result = {
+            "name": "{0}/{1}".format(agent, size),
+            "agent": agent,
+            "size": size,
+            "board_size": board_size,
+            "games": len(scores),
+            "steps": steps,
+            "mean_score": sum(scores) / len(scores) if scores else 0.0,
+            "decisions": len(latencies),
+            "expanded_nodes": expanded_nodes,
+            "rollouts": counter.simulations,
+            "peak_memory": None,
+            "latencies": [],
+            "samples": {metric: [] for metric in SCENARIO_METRICS},
+        }
+    result["latencies"].extend(latencies)
+    decision_time = sum(latencies) / 1e9
+    samples = result["samples"]
+    samples["steps_per_second"].append(steps / duration if duration > 0 else 0.0)
+    samples["expansions_per_second"].append(expanded_nodes / decision_time if decision_time > 0 else 0.0)
+    samples["rollouts_per_second"].append(counter.simulations / counter.duration if counter.duration > 0 else 0.0)
+    return result
+
+
+def finish_scenario(result):
+    """
+    Replaces decision latencies of all runs with their percentiles and sets
+    throughput metrics to medians of the samples.
+    :param result: result of all runs of a scenario.
+    :return: the result.
+    """
+    latencies = sorted(result.pop("latencies"))
+    result["latency_ms"] = {name: percentile(latencies, percent) / 1e6
+                            for name, percent in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))}
+    for metric in SCENARIO_METRICS:
+        result[metric] = median(result["samples"][metric])
+    return result
+
+
+def measure_memory(agent, board_size, seed, workers=1):
+    """
+    Plays the scenario with tracing of memory allocations. Tracing slows the
+    games down, so memory is measured in a separate run.
+    :return: peak of traced memory in bytes.
+    """
+    games, max_steps, agent_options = BUDGETS[agent]
+    tracemalloc.start()
+    try:
+        play(agent, board_size, games, max_steps, agent_options, seed, workers)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def create_long_state(kernel, length):
+    """
+    Creates compact state of a snake that winds through the board row by row.
+    :param kernel: step kernel of the board.
+    :param length: length of the snake.
+    :return: compact state and action that moves the snake along its path.
+    """
+    path = []
+    for y in range(kernel.height):
+        row = [y * kernel.width + x for x in range(kernel.width)]
+        path.extend(row if y % 2 == 0 else reversed(row))
+    length = max(2, min(length, len(path) - 2))
+    body = tuple(reversed(path[:length]))
+    head = body[0]
+    action = next(action for action in DIRECTION if kernel.moves[4 * head + action] == path[length])
+    return (body, path[-1], action), action
+
+
+def create_cycle(board_size):
+    """
+    Creates a cycle through the board that a snake can follow forever: along
+    the first row, row by row back through the other columns and up the first
+    column. Boards of odd size leave out the last row and column.
+    :param board_size: game board size.
+    :return: list of x,y positions of the cycle.
+    """
+    size = board_size - board_size % 2
+    cycle = [(x, 0) for x in range(size)]
+    for y in range(1, size):
+        columns = range(size - 1, 0, -1) if y % 2 == 1 else range(1, size)
+        cycle.extend((x, y) for x in columns)
+    cycle.extend((0, y) for y in range(size - 1, 0, -1))
+    return cycle
+
+
+def create_micro(size, board_size, seed):
+    """
+    Prepares micro-benchmarks of engine hot paths on one board. Snake of half
+    the board is used where the cost depends on the length of the snake.
+    Number of calls of every function is chosen so that one measurement
+    takes at least 0.2 seconds.
+    :param size: name of the board size.
+    :param board_size: game board size.
+    :param seed: random seed.
+    :return: list of (result, timer, number of calls) for every function.
+    """
+    random.seed(seed)
+    game_state = GameState(board_size, board_size)
+    kernel = get_kernel(board_size, board_size)
+    state, action = create_long_state(kernel, board_size * board_size // 2)
+    keys = get_zobrist_keys(board_size, board_size)
+    board = Board(game_state)
+    key_state = state + (keys.state_key(*state),)
+    snake, food_spawn, cells = game_state.snake, game_state.food_spawn, game_state.empty_cells()
+    body_encoder, feature_encoder = BodyStateEncoder(), FeatureStateEncoder()
+    # snake as long as the one of the kernel follows a cycle, so it moves without dying
+    cycle = create_cycle(board_size)
+    snake.body = [list(position) for position in reversed(cycle[:min(len(state[0]), len(cycle) - 1)])]
+    directions = {}
+    for i, (x, y) in enumerate(cycle):
+        next_x, next_y = cycle[(i + 1) % len(cycle)]
+        directions[x, y] = next(direction for direction in DIRECTION
+                                if DELTAS[direction] == (next_x - x, next_y - y))
+
+    def move():
+        head = snake.head
+        snake.direction = directions[head[0], head[1]]
+        snake.move(None)
+        return snake.check_collision()
+
+    def spawn_food():
+        food_spawn.set_food_on_board(False)
+        food_spawn.spawn_food(cells)
+
+    functions = [
+        ("step", lambda: kernel.step(state, action)),
+        ("move_collision", move),
+        ("food_spawn", spawn_food),
+        ("state_key", lambda: keys.state_key(*state)),
+        ("incremental_key", lambda: board.next_state(key_state, action)),
+        ("encode_body", lambda: body_encoder.encode(game_state)),
+        ("encode_features", lambda: feature_encoder.encode(game_state)),
+    ]
+    micro = []
+    for name, function in functions:
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        result = {"name": "{0}/{1}".format(name, size), "operation": name, "size": size, "board_size": board_size,
+                  "snake_length": len(state[0]), "samples": {metric: [] for metric in MICRO_METRICS}}
+        micro.append((result, timer, number))
+    return micro
+
+
+def run_benchmarks(agents=None, sizes=None, seed=0, memory=True, micro=True, repeat=1, workers=1):
+    """
+    Runs agent scenarios and micro-benchmarks. Every round runs each of them
+    once, so repeated samples of a metric are spread over the whole benchmark
+    and include its drift. Games are played in a temporary working directory,
+    so stored Q-tables are neither loaded nor written.
+    :param agents: names of the agents, all agents by default.
+    :param sizes: names of the sizes, playable and synthetic sizes by default.
+    :param seed: random seed of every scenario.
+    :param memory: whether to measure peak memory of scenarios.
+    :param micro: whether to run micro-benchmarks.
+    :param repeat: number of rounds.
+    :param workers: number of processes of Monte Carlo searches.
+    :return: dictionary with environment, scenarios and micro-benchmarks.
+    """
+    all_sizes = dict(SIZES, **SYNTHETIC_SIZES)
+    agents = [agent.upper() for agent in agents] if agents else AGENTS
+    sizes = [size.upper() for size in sizes] if sizes else list(all_sizes)
+    # playable sizes are adjusted the same way as in the game
+    scenarios = [(agent, size, get_board_size(agent, size) if size in SIZES else all_sizes[size])
+                 for size in sizes for agent in agents]
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "repeat": repeat,
+        "workers": workers,
+        "scenarios": [None] * len(scenarios),
+        "micro": [],
+    }
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as temporary:
+        os.chdir(temporary)
+        try:
+            micro = [benchmark for size in sizes for benchmark in create_micro(size, all_sizes[size], seed)] \
+                if micro else []
+            for i in range(repeat):
+                print("Round {0}/{1}".format(i + 1, repeat))
+                for j, (agent, size, board_size) in enumerate(scenarios):
+                    results["scenarios"][j] = run_scenario(agent, size, board_size, seed, results["scenarios"][j],
+                                                           workers)
+                for result, timer, number in micro:
+                    result["samples"]["ops_per_second"].append(number / timer.timeit(number))
+            for j, (agent, size, board_size) in enumerate(scenarios):
+                result = finish_scenario(results["scenarios"][j])
+                if memory:
+                    result["peak_memory"] = measure_memory(agent, board_size, seed, workers)
+                print("{0:<14} {1:>10.0f} steps/s  p50 {2:8.3f} ms  p99 {3:8.3f} ms"
+                      .format(result["name"], result["steps_per_second"], result["latency_ms"]["p50"],
+                              result["latency_ms"]["p99"]))
+            for result, _, _ in micro:
+                result["ops_per_second"] = median(result["samples"]["ops_per_second"])
+                results["micro"].append(result)
+                print("{0:<24} {1:>12.0f} ops/s".format(result["name"], result["ops_per_second"]))
+        finally:
+            os.chdir(directory)
+    return results
+
+
+def count_rank_sums(n, m):
+    """
+    Exact null distribution of Mann-Whitney U statistic.
+    :param n: size of the first sample.
+    :param m: size of the second sample.
+    :return: list where item u is number of orderings with statistic u.
+    """
+    # counts[j][u] for first i values and j values of the second sample
+    counts = [[1] + [0] * (n * m) for _ in range(m + 1)]
+    for i in range(1, n + 1):
+        previous, counts = counts, [[1 if u == 0 else 0 for u in range(n * m + 1)]]
+        for j in range(1, m + 1):
+            # the largest value is either from the first sample and it is
+            # greater than all j values of the second one, or from the second
+            counts.append([(previous[j][u - j] if u >= j else 0) + counts[j - 1][u] for u in range(n * m + 1)])
+    return counts[m]
+
+
+def regression_probability(baseline, current):
+    """
+    One-sided exact Mann-Whitney U test of the hypothesis that current
+    values are lower than baseline values.
+    :param baseline: samples of the baseline.
+    :param current: samples of the current run.
+    :return: p-value, probability of an U statistic at most as low as the
+    observed one when both samples come from the same distribution. Ties
+    are rounded up, so they do not make the result more significant.
+    """
+    statistic = sum(1.0 if value > base else 0.5 if value == base else 0.0
+                    for value in current for base in baseline)
+    counts = count_rank_sums(len(current), len(baseline))
+    return sum(counts[:math.ceil(statistic) + 1]) / sum(counts)
+
+
+def compare(baseline, current, threshold=10.0, alpha=0.05):
+    """
+    Compares throughput metrics of the same scenarios. Metric regresses when
+    its median is lower than the baseline by more than threshold percent and
+    the difference is significant, so noise of single runs is not reported.
+    :param baseline: results of the baseline run.
+    :param current: results of the current run.
+    :param threshold: allowed slowdown in percent.
+    :param alpha: significance level of the test.
+    :return: list of regressions, dictionaries with name, metric, medians,
+    change in percent and p-value.
+    """
+    if 1 / sum(count_rank_sums(baseline.get("repeat", 1), current.get("repeat", 1))) >= alpha:
+        # even completely separated samples would not be significant
+        print("Scenarios have too few runs to find significant regressions, use more repeats")
+    regressions = []
+    for group, metrics in (("scenarios", SCENARIO_METRICS), ("micro", MICRO_METRICS)):
+        results = {result["name"]: result for result in current[group]}
+        for base in baseline[group]:
+            result = results.get(base["name"])
+            if result is None:
+                print("{0:<24} missing in current run".format(base["name"]))
+                continue
+            if group == "scenarios" and result["steps"] != base["steps"]:
+                # seeded games should play the same, otherwise throughput is not comparable
+                print("{0:<24} workload changed: {1} steps, baseline {2} steps"
+                      .format(base["name"], result["steps"], base["steps"]))
+            for metric in metrics:
+                base_samples, samples = base["samples"][metric], result["samples"][metric]
+                base_median, current_median = median(base_samples), median(samples)
+                if base_median <= 0:
+                    continue
+                change = (current_median - base_median) / base_median * 100
+                probability = regression_probability(base_samples, samples)
+                regressed = change < -threshold and probability < alpha
+                print("{0:<24} {1:<22} {2:>12.1f} {3:>12.1f} {4:>+8.1f}% p={5:.3f}{6}"
+                      .format(base["name"], metric, base_median, current_median, change, probability,
+                              "  REGRESSION" if regressed else ""))
+                if regressed:
+                    regressions.append({"name": base["name"], "metric": metric, "baseline": base_median,
+                                        "current": current_median, "change": change, "p_value": probability})
+    return regressions
+
+
+def parse_args(argv):
+    """
+    Parse program arguments.
+    :param argv: list of strings that represent program arguments.
+    :return: options of the benchmarks, output file, baseline file (None when
+    not comparing) and allowed slowdown in percent.
+    """
+    usage = "benchmark.py [-a <agent>]... [-s <size>]... [-o <file>] [--seed=<seed>] [-r <repeat>] " \
+            "[-w <workers>] [--no-memory] [--no-micro] [--compare=<baseline> [--threshold=<percent>]]"
+    try:
+        opts, args = getopt.getopt(argv, "ha:s:o:r:w:", ["help", "agent=", "size=", "output=", "seed=", "repeat=",
+                                                         "workers=", "no-memory", "no-micro", "compare=",
+                                                         "threshold="])
+    except getopt.GetoptError:
+        print("Wrong arguments")
+        print(usage)
+        sys.exit(2)
+
+    agents, sizes, output, seed, memory, micro = [], [], "benchmark.json", 0, True, True
+    repeat, baseline, threshold, workers = None, None, 10.0, 1
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-a", "--agent"):
+            if arg.upper() not in AGENTS:
+                print("Allowed values for -a (agent) argument are: " + " ".join(AGENTS))
+                sys.exit(2)
+            agents.append(arg)
+        elif opt in ("-s", "--size"):
+            if arg.upper() not in SIZES and arg.upper() not in SYNTHETIC_SIZES:
+                print("Allowed values for -s (size) argument are: " + " ".join(list(SIZES) + list(SYNTHETIC_SIZES)))
+                sys.exit(2)
+            sizes.append(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--no-memory":
+            memory = False
+        elif opt == "--no-micro":
+            micro = False
+        elif opt in ("-r", "--repeat"):
+            repeat = int(arg)
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt == "--compare":
+            baseline = arg
+        elif opt == "--threshold":
+            threshold = float(arg)
+    # significance test needs several samples of every metric
+    repeat = repeat or (5 if baseline is not None else 1)
+    options = {"agents": agents, "sizes": sizes, "seed": seed, "memory": memory, "micro": micro, "repeat": repeat,
+               "workers": workers}
+    return options, output, baseline, threshold
+
+
+if __name__ == '__main__':
+    options, output, baseline, threshold = parse_args(sys.argv[1:])
+    if baseline is not None:
+        with open(baseline) as file:
+            baseline = json.load(file)
+        # rerun the scenarios of the baseline, memory is not compared
+        options["agents"] = options["agents"] or sorted({result["agent"] for result in baseline["scenarios"]},
+                                                        key=AGENTS.index)
+        options["sizes"] = options["sizes"] or list(dict.fromkeys(result["size"] for result in
+                                                                  baseline["scenarios"] + baseline["micro"]))
+        options["seed"], options["memory"], options["micro"] = baseline["seed"], False, bool(baseline["micro"])
+        options["workers"] = baseline.get("workers", 1)
+    results = run_benchmarks(**options)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print("Results written to " + output)
+    if baseline is not None:
+        regressions = compare(baseline, results, threshold)
+        if regressions:
+            print("{0} regressions past {1}%".format(len(regressions), threshold))
+            sys.exit(1)
+        print("No regressions")
@@ -1,73 +1,246 @@
 import pygame
 import sys
-from search_agents import *
-from reinforcement_agents import *
-from general_agents import MCAgent
+from itertools import islice
+from simulation import *
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Define Constants
+BACKGROUND_COLOR = (225, 225, 225)  # Light Gray
 HEAD_COLOR = (0, 100, 0)  # Dark Green
 BODY_COLOR = (0, 200, 0)  # Light Green
 FOOD_COLOR = (200, 0, 0)  # Dark Red
 
+# colors of cells of incremental renderers
+BACKGROUND, BODY, HEAD, FOOD = range(4)
+COLORS = [BACKGROUND_COLOR, BODY_COLOR, HEAD_COLOR, FOOD_COLOR]
 
-class Game(ABC):
 
-    def __init__(self, board_size, agent=None, game_speed=10, block_size=20):
-        self.__board_size = board_size
+class Renderer(ABC):
+    """
+    Draws game state to the window and shows it on screen.
+    """
+    def __init__(self, window, board_size, block_size):
+        """
+        :param window: display surface.
+        :param board_size: size of a game board.
+        :param block_size: size of a cell in pixels.
+        """
+        self.window = window
+        self.board_size = board_size
+        self.block_size = block_size
+
+    @abstractmethod
+    def draw(self, snake, food_pos):
+        """
+        Draw new game state.
+        :param snake: snake of the game.
+        :param food_pos: current food position.
+        """
+        pass
+
+    @abstractmethod
+    def show(self):
+        """
+        Show drawn state on screen.
+        """
+        pass
+
+    def cell_rect(self, x, y):
+        return pygame.Rect(x * self.block_size, y * self.block_size, self.block_size, self.block_size)
+
+
+class FullRenderer(Renderer):
+    """
+    Redraws the whole board every frame.
+    """
+    def draw(self, snake, food_pos):
+        self.window.fill(pygame.Color(*BACKGROUND_COLOR))
+        # Draw snake, head over the body when they collide
+        for pos in islice(snake.body, 1, None):
+            pygame.draw.rect(self.window, BODY_COLOR, self.cell_rect(pos[0], pos[1]))
+        pygame.draw.rect(self.window, HEAD_COLOR, self.cell_rect(snake.head[0], snake.head[1]))
+        # Draw food
+        if food_pos is not None:
+            pygame.draw.rect(self.window, FOOD_COLOR, self.cell_rect(food_pos[0], food_pos[1]))
+
+    def show(self):
+        pygame.display.flip()
+
+
+class IncrementalRenderer(Renderer):
+    """
+    Keeps color of every cell and paints only cells that changed since the
+    last frame: new and old head, new and old tail and new and old food.
+    Everything is painted again when the snake did not make exactly one move
+    since the last frame, for example when a new game starts.
+    """
+    def __init__(self, window, board_size, block_size):
+        super().__init__(window, board_size, block_size)
+        self.__colors = bytearray(board_size * board_size)
+        self.__snake = None
+        # head, tail, segment before the tail and length in the last frame
+        self.__segments = None
+        self.__food = None
+
+    def draw(self, snake, food_pos):
+        body = snake.body
+        food = None if food_pos is None else tuple(food_pos)
+        head, tail = tuple(snake.head), tuple(body[-1])
+        if self.__moved(snake):
+            cells = {head, tail, self.__segments[0], self.__segments[1], self.__food, food}
+        else:
+            self.__snake = snake
+            self.__colors = bytearray(self.board_size * self.board_size)
+            self.clear()
+            cells = set(tuple(pos) for pos in body)
+            cells.add(food)
+        self.__segments = head, tail, tuple(body[-2]) if len(body) > 1 else tail, len(body)
+        self.__food = food
+        for cell in cells:
+            if cell is None or not (0 <= cell[0] < self.board_size and 0 <= cell[1] < self.board_size):
+                continue
+            # food is drawn over the snake and head over the body
+            if cell == food:
+                color = FOOD
+            elif cell == head:
+                color = HEAD
+            elif snake.is_occupied(cell[0], cell[1]):
+                color = BODY
+            else:
+                color = BACKGROUND
+            index = cell[1] * self.board_size + cell[0]
+            if self.__colors[index] != color:
+                self.__colors[index] = color
+                self.paint(cell[0], cell[1], color)
+
+    def __moved(self, snake):
+        """
+        :param snake: snake of the game.
+        :return: if the snake of the last frame made one move, so only cells
+        next to its ends changed.
+        """
+        if snake is not self.__snake or self.__segments is None or len(snake.body) < 2:
+            return False
+        head, tail, before_tail, length = self.__segments
+        body = snake.body
+        if tuple(body[1]) != head:
+            return False
+        if len(body) == length + 1:
+            # snake grew and kept its tail
+            return tuple(body[-1]) == tail
+        return len(body) == length and tuple(body[-1]) == before_tail
+
+    @abstractmethod
+    def clear(self):
+        """
+        Paint the whole board with background color.
+        """
+        pass
+
+    @abstractmethod
+    def paint(self, x, y, color):
+        """
+        Paint a cell.
+        :param x: x coordinate of the cell.
+        :param y: y coordinate of the cell.
+        :param color: one of BACKGROUND, BODY, HEAD and FOOD.
+        """
+        pass
+
+
+class DirtyRectRenderer(IncrementalRenderer):
+    """
+    Draws changed cells to the window and updates only their rectangles
+    on screen.
+    """
+    def __init__(self, window, board_size, block_size):
+        super().__init__(window, board_size, block_size)
+        self.__dirty = []
+
+    def clear(self):
+        self.window.fill(pygame.Color(*BACKGROUND_COLOR))
+        self.__dirty = [self.window.get_rect()]
+
+    def paint(self, x, y, color):
+        rect = self.cell_rect(x, y)
+        pygame.draw.rect(self.window, COLORS[color], rect)
+        self.__dirty.append(rect)
+
+    def show(self):
+        if self.__dirty:
+            pygame.display.update(self.__dirty)
+            self.__dirty = []
+
+
+class SurfarrayRenderer(IncrementalRenderer):
+    """
+    Keeps colors of cells in a NumPy array and copies the whole board to the
+    window at once: one blit of the array to a surface with a pixel for each
+    cell and one scaling of that surface to the window. Cost of a frame
+    does not depend on the length of the snake, which suits large boards.
+    """
+    def __init__(self, window, board_size, block_size):
+        if np is None:
+            raise ImportError("Surfarray renderer requires numpy")
+        super().__init__(window, board_size, block_size)
+        self.__palette = np.array(COLORS, dtype=np.uint8)
+        self.__cells = np.zeros((board_size, board_size), dtype=np.uint8)
+        # pixel format of the window, so the surface can be scaled into it
+        self.__surface = pygame.Surface((board_size, board_size), 0, window)
+
+    def clear(self):
+        self.__cells.fill(BACKGROUND)
+
+    def paint(self, x, y, color):
+        self.__cells[x, y] = color
+
+    def show(self):
+        pygame.surfarray.blit_array(self.__surface, self.__palette[self.__cells])
+        pygame.transform.scale(self.__surface, self.window.get_size(), self.window)
+        pygame.display.flip()
+
+
+def get_renderer(renderer, window, board_size, block_size):
+    """
+    :param renderer: name of the renderer: full, dirty or surfarray.
+    :param window: display surface.
+    :param board_size: size of a game board.
+    :param block_size: size of a cell in pixels.
+    :return: renderer.
+    """
+    if renderer.upper() == "FULL":
+        return FullRenderer(window, board_size, block_size)
+    elif renderer.upper() == "DIRTY":
+        return DirtyRectRenderer(window, board_size, block_size)
+    elif renderer.upper() == "SURFARRAY":
+        return SurfarrayRenderer(window, board_size, block_size)
+    raise ValueError("Unknown renderer: {0}".format(renderer))
+
+
+class Game(Simulation):
+
+    def __init__(self, board_size, agent=None, game_speed=10, block_size=20, renderer="DIRTY", **kwargs):
+        super().__init__(board_size, agent, **kwargs)
         self.__block_size = block_size
         self.__game_speed = game_speed
-        self.__game_state = GameState(board_size, board_size)
-        self.__window = pygame.display.set_mode((self.__board_size*self.__block_size,
-                                                 self.__board_size*self.__block_size))
+        self.__window = pygame.display.set_mode((self.board_size*self.__block_size,
+                                                 self.board_size*self.__block_size))
+        self.__renderer = get_renderer(renderer, self.__window, self.board_size, self.__block_size)
         self.__fps = pygame.time.Clock()
-        self.__score = 0
-        self.__snake = self.__game_state.snake
-        self.__food_spawn = self.__game_state.food_spawn
-        self.__agent = self.get_agent(agent)
-
-    def get_agent(self, agent):
-        if agent is None:
-            return None
-        elif agent.upper() == "RANDOM":
-            return RandomSearchAgent()
-        elif agent.upper() == "ZIGZAG":
-            return ZigZagSearchAgent(EatFoodProblem(self.__game_state))
-        elif agent.upper() == "SMART":
-            return SmartSearchAgent(EatFoodProblem(self.__game_state))
-        elif agent.upper() == "OROBORUS":
-            return OroborusSearchAgent(ReachPositionProblem(self.__game_state))
-        elif agent.upper() == "MC":
-            return MCAgent(self.__game_state)
-        return None
 
     def draw_new_state(self, food_pos):
         """
         Draw new game state on screen.
         :param food_pos: current food position.
         """
-        self.__window.fill(pygame.Color(225, 225, 225))
-        # Draw snake
-        head = 1
-        for pos in self.__snake.body:
-            if head == 1:
-                pygame.draw.rect(self.__window, HEAD_COLOR, pygame.Rect(pos[0] * self.__block_size,
-                                                                        pos[1] * self.__block_size,
-                                                                        self.__block_size,
-                                                                        self.__block_size))
-                head = 0
-            else:
-                pygame.draw.rect(self.__window, BODY_COLOR, pygame.Rect(pos[0] * self.__block_size,
-                                                                        pos[1] * self.__block_size,
-                                                                        self.__block_size,
-                                                                        self.__block_size))
-        # Draw food
-        pygame.draw.rect(self.__window, FOOD_COLOR, pygame.Rect(food_pos[0] * self.__block_size,
-                                                                food_pos[1] * self.__block_size,
-                                                                self.__block_size,
-                                                                self.__block_size))
+        self.__renderer.draw(self.snake, food_pos)
 
     def game_over(self):
-        pygame.display.set_caption("Score: " + str(self.__score) +
+        super().game_over()
+        pygame.display.set_caption("Score: " + str(self.score) +
                                    " | GAME OVER. Press any key to quit ...")
         while True:
             evt = pygame.event.wait()
@@ -77,63 +250,24 @@ class Game(ABC):
             sys.exit()
 
     def update(self):
-        pygame.display.set_caption("Score: " + str(self.__score))
-        pygame.display.flip()
+        super().update()
+        pygame.display.set_caption("Score: " + str(self.score))
+        self.__renderer.show()
         self.__fps.tick(self.__game_speed)
 
-    @abstractmethod
-    def start_game(self):
-        pass
-
-    @property
-    def score(self):
-        return self.__score
-
-    @score.setter
-    def score(self, value):
-        self.__score = value
-
     @property
     def fps(self):
         return self.__fps
 
     @property
-    def food_spawn(self):
-        return self.__food_spawn
-
-    @food_spawn.setter
-    def food_spawn(self, value):
-        self.__food_spawn = value
-
-    @property
-    def snake(self):
-        return self.__snake
-
-    @snake.setter
-    def snake(self, value):
-        self.__snake = value
-
-    @property
-    def agent(self):
-        return self.__agent
-
-    @agent.setter
-    def agent(self, value):
-        self.__agent = value
-
-    @property
-    def game_state(self):
-        return self.__game_state
-
-    @game_state.setter
-    def game_state(self, value):
-        self.__game_state = value
+    def renderer(self):
+        return self.__renderer
 
 
 class ManualGame(Game):
 
-    def __init__(self, board_size, agent=None):
-        super().__init__(board_size, agent)
+    def __init__(self, board_size, agent=None, renderer="DIRTY"):
+        super().__init__(board_size, agent, renderer=renderer)
 
     def __update_snake(self):
         """
@@ -170,160 +304,27 @@ class ManualGame(Game):
             self.update()
 
 
-class SmartAgentsGame(Game):
-
-    def __init__(self, board_size, agent=None, game_speed=10, block_size=20):
-        super().__init__(board_size, agent, game_speed, block_size)
-
-    def start_game(self):
-        while True:
-            self.snake.change_direction(self.agent.get_next_action())
-            food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
-
-            if self.snake.move(food_pos) == 1:
-                self.score += 1
-                self.food_spawn.set_food_on_board(False)
-                self.draw_new_state(food_pos)
-                if self.snake.check_collision():
-                    self.game_over()
-                    break
-                self.food_spawn.spawn_food(self.game_state.empty_cells())
-                self.agent.problem.reset(self.game_state)
-                self.agent.update()
-            else:
-                self.draw_new_state(food_pos)
-
-                if self.snake.check_collision():
-                    self.game_over()
-                    break
-                if self.agent.problem is not None:
-                    self.agent.problem.reset(self.game_state)
-                self.agent.update()
-
-            self.update()
-
-
-class OroborusAgentGame(Game):
-
-    def __init__(self, board_size, agent=None, game_speed=10, block_size=20):
-        super().__init__(board_size, agent, game_speed, block_size)
-
-    def start_game(self):
-        while True:
-            if self.agent.action_count() == 0:
-                self.agent.problem.reset(self.game_state)
-                self.agent.update()
-            self.snake.change_direction(self.agent.get_next_action())
-            food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
-            if food_pos is None:
-                self.game_over()
-                break
-            if self.snake.move(food_pos) == 1:
-                self.score += 1
-                self.food_spawn.set_food_on_board(False)
-                self.draw_new_state(food_pos)
-                if self.snake.check_collision():
-                    self.game_over()
-                    break
-                self.food_spawn.spawn_food(self.game_state.empty_cells())
-            else:
-                self.draw_new_state(food_pos)
-                if self.snake.check_collision():
-                    self.game_over()
-                    break
-
-            self.update()
-
-
-class GeneralAgentGame(Game):
-
-    def __init__(self, board_size, agent=None, game_speed=10, block_size=20):
-        super().__init__(board_size, agent, game_speed, block_size)
-
-    def start_game(self):
-        while True:
-            self.snake.change_direction(self.agent.get_next_action())
-            food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
+class SmartAgentsGame(Game, SmartAgentsSimulation):
 
-            if self.snake.move(food_pos) == 1:
-                self.score += 1
-                self.food_spawn.set_food_on_board(False)
-                self.draw_new_state(food_pos)
-                if self.snake.check_collision():
-                    self.game_over()
-                    break
-                self.food_spawn.spawn_food(self.game_state.empty_cells())
-            else:
-                self.draw_new_state(food_pos)
-                if self.snake.check_collision():
-                    self.game_over()
-                    break
+    def __init__(self, board_size, agent=None, game_speed=10, block_size=20, renderer="DIRTY"):
+        super().__init__(board_size, agent, game_speed, block_size, renderer)
 
-            self.update()
 
+class OroborusAgentGame(Game, OroborusAgentSimulation):
 
-class ReinforcementAgentsGame(Game):
+    def __init__(self, board_size, agent=None, game_speed=10, block_size=20, renderer="DIRTY"):
+        super().__init__(board_size, agent, game_speed, block_size, renderer)
 
-    def __init__(self, board_size, agent=None, game_speed=10, block_size=20, episodes=100):
-        super().__init__(board_size, agent, game_speed, block_size)
-        self.agent = self.get_agent(agent)
-        self.__episodes = episodes
-        self.__counter = 0
-        self.__scores = {}
 
-    def get_agent(self, agent):
-        if agent is None:
-            return None
-        elif agent.upper() == "Q":
-            return QAgent(Environment(self.game_state))
-        elif agent.upper() == "MCQ":
-            return MCQAgent(Environment(self.game_state))
-        return None
+class GeneralAgentGame(Game, GeneralAgentSimulation):
 
-    def start_game(self):
-        while True:
-            if self.__counter == self.__episodes:
-                break
-            action = self.agent.get_next_action()
-            self.snake.change_direction(action)
-            self.agent.current_action = action
-            food_pos = self.food_spawn.food
+    def __init__(self, board_size, agent=None, game_speed=10, block_size=20, renderer="DIRTY", agent_options=None):
+        super().__init__(board_size, agent, game_speed, block_size, renderer, agent_options=agent_options)
 
-            if self.snake.move(food_pos) == 1:
-                self.agent.current_reward = self.agent.environment.get_reward()
-                self.agent.update()
-                self.score += 1
-                self.food_spawn.set_food_on_board(False)
-                food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
-                self.draw_new_state(food_pos)
-                if self.snake.check_collision():
-                    self.__reset()
-                    self.draw_new_state(food_pos)
-            else:
-                self.agent.current_reward = self.agent.environment.get_reward()
-                self.agent.update()
-                self.draw_new_state(food_pos)
 
-                if self.snake.check_collision():
-                    self.__reset()
-                    self.draw_new_state(food_pos)
+class ReinforcementAgentsGame(Game, ReinforcementAgentsSimulation):
 
-            self.update()
-        with open("q_agent_table.pickle", "wb+") as file:
-            pickle.dump(self.agent.q_table, file)
-        print(self.__scores)
-
-    def __reset(self):
-        self.game_state = GameState(self.game_state.height, self.game_state.width)
-        print("Score:", self.score)
-        if self.score in self.__scores.keys():
-            self.__scores[self.score] += 1
-        else:
-            self.__scores[self.score] = 1
-        self.score = 0
-        self.snake = self.game_state.snake
-        self.food_spawn = self.game_state.food_spawn
-        self.agent.environment = Environment(self.game_state)
-        self.agent.reset()
-        self.__counter += 1
-        print("Episode :", self.__counter)
+    def __init__(self, board_size, agent=None, game_speed=10, block_size=20, episodes=100, encoder=None,
+                 renderer="DIRTY", agent_options=None):
+        super().__init__(board_size, agent, game_speed, block_size, renderer, episodes=episodes, encoder=encoder,
+                         agent_options=agent_options)
@@ -4,13 +4,23 @@ import monte_carlo_tree_search as mc
 
 class MCAgent(Agent):
 
-    def __init__(self, game_state):
+    def __init__(self, game_state, **kwargs):
+        """
+        Creates agent with Monte Carlo Tree Search.
+        :param game_state: current state of a game.
+        :param kwargs: parametric arguments of the search, e.g. workers
+        for number of processes that run simulations.
+        """
         self.__game_state = game_state
-        self.__monte_carlo = mc.MonteCarloTreeSearch(mc.Board(self.__game_state))
+        self.__monte_carlo = mc.MonteCarloTreeSearch(mc.Board(self.__game_state), **kwargs)
 
     def update(self):
         pass
 
     def get_next_action(self):
-        self.__monte_carlo = mc.MonteCarloTreeSearch(mc.Board(self.__game_state))
+        # reuse the tree built during previous moves
+        self.__monte_carlo.update(mc.get_state(self.__game_state))
         return self.__monte_carlo.get_action()
+
+    def close(self):
+        self.__monte_carlo.close()
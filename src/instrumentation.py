@@ -0,0 +1,193 @@
+import cProfile
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from model import GameState, Snake
+
+# number of power of two buckets of a histogram of nanoseconds
+BUCKETS = 64
+
+
+class PhaseTimer:
+    """
+    Measures phases of the game loop: agent decision and update, free cells,
+    snake move, collision check, drawing and display update. Phase methods
+    are wrapped only while the timer is installed, so games without timer
+    run unchanged. Every phase keeps a histogram with power of two buckets
+    of nanoseconds, so recording costs the same during long games. Timeline
+    of phases is kept only when a trace is requested.
+    """
+    def __init__(self, trace=False, max_events=1000000):
+        """
+        :param trace: whether to record timeline of phases.
+        :param max_events: maximum number of recorded phases of the timeline.
+        """
+        self.__phases = {}
+        self.__events = [] if trace else None
+        self.__max_events = max_events
+        self.__originals = []
+        self.__start = time.perf_counter_ns()
+
+    def record(self, phase, start, duration):
+        """
+        :param phase: name of the phase.
+        :param start: start of the phase in nanoseconds of the performance counter.
+        :param duration: duration of the phase in nanoseconds.
+        """
+        statistics = self.__phases.get(phase)
+        if statistics is None:
+            # count, total, minimum, maximum and histogram
+            statistics = self.__phases[phase] = [0, 0, duration, duration, [0] * BUCKETS]
+        statistics[0] += 1
+        statistics[1] += duration
+        if duration < statistics[2]:
+            statistics[2] = duration
+        if duration > statistics[3]:
+            statistics[3] = duration
+        statistics[4][duration.bit_length()] += 1
+        events = self.__events
+        if events is not None and len(events) < self.__max_events:
+            events.append((phase, start, duration))
+
+    def wrap(self, phase, function):
+        """
+        :param phase: name of the phase.
+        :param function: function that runs the phase.
+        :return: function that records duration of every call.
+        """
+        record, clock = self.record, time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(phase, start, clock() - start)
+        return timed
+
+    def install(self, game):
+        """
+        Wraps phase methods. Methods of the snake, game state and game are
+        wrapped in their classes, because they are replaced when an episode
+        ends, and the agent is wrapped itself.
+        :param game: game with display.
+        """
+        import pygame
+        methods = [(Snake, "move", "snake.move"), (Snake, "check_collision", "check_collision"),
+                   (GameState, "empty_cells", "empty_cells"),
+                   (self.__owner(type(game), "draw_new_state"), "draw_new_state", "draw_new_state"),
+                   # caption, display update and waiting for the frame limiter
+                   (self.__owner(type(game), "update"), "update", "update"),
+                   (pygame.display, "flip", "display.flip"), (pygame.display, "update", "display.update")]
+        if game.agent is not None:
+            methods += [(game.agent, "get_next_action", "agent.get_next_action"),
+                        (game.agent, "update", "agent.update")]
+        for owner, name, phase in methods:
+            self.__originals.append((owner, name, vars(owner).get(name)))
+            setattr(owner, name, self.wrap(phase, getattr(owner, name)))
+
+    def uninstall(self):
+        """
+        Restores wrapped methods.
+        """
+        for owner, name, original in reversed(self.__originals):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self.__originals = []
+
+    @staticmethod
+    def __owner(cls, name):
+        return next(owner for owner in cls.__mro__ if name in vars(owner))
+
+    def summary(self):
+        """
+        Percentiles are upper bounds of histogram buckets.
+        :return: list of dictionaries with statistics of every phase.
+        """
+        wall = time.perf_counter_ns() - self.__start
+        summary = []
+        for phase, (count, total, minimum, maximum, histogram) in self.__phases.items():
+            summary.append({
+                "phase": phase,
+                "count": count,
+                "total_ms": total / 1e6,
+                "share": total / wall if wall > 0 else 0.0,
+                "mean_us": total / count / 1e3,
+                "min_us": minimum / 1e3,
+                "p50_us": min(histogram_percentile(histogram, 50), maximum) / 1e3,
+                "p99_us": min(histogram_percentile(histogram, 99), maximum) / 1e3,
+                "max_us": maximum / 1e3,
+            })
+        summary.sort(key=lambda phase: phase["total_ms"], reverse=True)
+        return summary
+
+    def print_summary(self):
+        print("{0:<24} {1:>8} {2:>11} {3:>7} {4:>10} {5:>10} {6:>10} {7:>10}"
+              .format("Phase", "Count", "Total ms", "Share", "Mean us", "p50 us", "p99 us", "Max us"))
+        for phase in self.summary():
+            print("{phase:<24} {count:>8} {total_ms:>11.1f} {share:>7.1%} {mean_us:>10.1f} {p50_us:>10.1f} "
+                  "{p99_us:>10.1f} {max_us:>10.1f}".format(**phase))
+
+    def write_trace(self, path):
+        """
+        Writes timeline of phases in Chrome trace event format, which can be
+        loaded into chrome://tracing or Perfetto.
+        :param path: file for the trace.
+        """
+        events = [{"name": phase, "cat": "game", "ph": "X", "pid": 1, "tid": 1,
+                   "ts": (start - self.__start) / 1e3, "dur": duration / 1e3}
+                  for phase, start, duration in self.__events or []]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+def histogram_percentile(histogram, percent):
+    """
+    :param histogram: counts of power of two buckets.
+    :param percent: percentile between 0 and 100.
+    :return: upper bound of the bucket that contains the percentile.
+    """
+    rank = sum(histogram) * percent / 100
+    count = 0
+    for bucket, bucket_count in enumerate(histogram):
+        count += bucket_count
+        if count >= rank and bucket_count:
+            return (1 << bucket) - 1
+    return 0
+
+
+def run_profiled(function, profiler=None, limit=20):
+    """
+    Runs function with profiler and prints the most expensive functions or
+    allocation sites. Results are printed also when the game exits the program.
+    :param function: function without arguments.
+    :param profiler: None, "cprofile" or "tracemalloc".
+    :param limit: number of printed lines.
+    """
+    if profiler is None:
+        function()
+    elif profiler == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            function()
+        finally:
+            profile.disable()
+            pstats.Stats(profile, stream=sys.stdout).sort_stats("cumulative").print_stats(limit)
+    elif profiler == "tracemalloc":
+        tracemalloc.start()
+        try:
+            function()
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("Current memory: {0:.1f} KiB, Peak memory: {1:.1f} KiB".format(current / 1024, peak / 1024))
+            for statistic in snapshot.statistics("lineno")[:limit]:
+                print(statistic)
+    else:
+        raise ValueError("Unknown profiler: {0}".format(profiler))
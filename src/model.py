@@ -1,4 +1,5 @@
 import random
+from collections import deque
 from enum import IntEnum, unique
 from abc import ABC, abstractmethod
 
@@ -10,6 +11,11 @@ class CellState(IntEnum):
     FOOD = 2
 
 
+FOOD_REWARD = 20
+COLLISION_REWARD = -20
+STEP_REWARD = -1
+
+
 @unique
 class DIRECTION(IntEnum):
     UP = 0
@@ -19,6 +25,143 @@ class DIRECTION(IntEnum):
     STOP = 4
 
 
+# x and y change of a position for every direction
+DELTAS = {
+    DIRECTION.UP: (0, -1),
+    DIRECTION.DOWN: (0, 1),
+    DIRECTION.LEFT: (-1, 0),
+    DIRECTION.RIGHT: (1, 0),
+    DIRECTION.STOP: (0, 0),
+}
+
+# legal actions for current direction of the snake, the snake cannot turn back
+LEGAL_ACTIONS = {
+    DIRECTION.UP: [DIRECTION.UP, DIRECTION.LEFT, DIRECTION.RIGHT],
+    DIRECTION.DOWN: [DIRECTION.DOWN, DIRECTION.LEFT, DIRECTION.RIGHT],
+    DIRECTION.LEFT: [DIRECTION.LEFT, DIRECTION.DOWN, DIRECTION.UP],
+    DIRECTION.RIGHT: [DIRECTION.RIGHT, DIRECTION.DOWN, DIRECTION.UP],
+}
+
+
+def move_position(position, direction):
+    """
+    Position next to given position in given direction.
+    :param position: x,y coordinates.
+    :param direction: direction of a move.
+    :return: new x,y coordinates.
+    """
+    dx, dy = DELTAS[direction]
+    return [position[0] + dx, position[1] + dy]
+
+
+class StepKernel:
+    """
+    Moves the snake one step. Cells are indices y * width + x and head
+    that left the board is stored as -1. Snake grows when it eats the food
+    and tail moves away otherwise, so the head can take the place of the
+    tail. Kernel does not spawn new food. Moves are made either on compact
+    states (step), immutable tuples (body, food, direction) with a tuple
+    of body cells from the head, which search agents keep in their nodes,
+    or in constant time on an occupancy array of a body that the caller
+    keeps (advance), which Snake.move and Board.rollout use.
+    """
+    def __init__(self, width, height):
+        """
+        Precomputes next cell for every cell and direction.
+        :param width: width of a game board.
+        :param height: height of a game board.
+        """
+        self.width = width
+        self.height = height
+        # moves[4 * cell + direction] is next cell or -1 outside of the board
+        self.moves = []
+        for cell in range(width * height):
+            x, y = cell % width, cell // width
+            for direction in (DIRECTION.UP, DIRECTION.DOWN, DIRECTION.LEFT, DIRECTION.RIGHT):
+                dx, dy = DELTAS[direction]
+                if 0 <= x + dx < width and 0 <= y + dy < height:
+                    self.moves.append((y + dy) * width + x + dx)
+                else:
+                    self.moves.append(-1)
+        # head that left the board (-1) stays outside
+        self.moves.extend([-1] * 4)
+
+    def step(self, state, action):
+        """
+        Moves the snake in given direction.
+        :param state: compact state.
+        :param action: direction of the move, snake can not stop.
+        :return: next state, if the snake ate the food and if it died.
+        """
+        if not 0 <= action < 4:
+            raise ValueError("Snake can not move in direction {0}".format(action))
+        body, food = state[0], state[1]
+        head = self.moves[4 * body[0] + action]
+        if head == food:
+            return ((head,) + body, food, action), True, head in body
+        return ((head,) + body[:-1], food, action), False, \
+            head < 0 or (head != body[-1] and head in body)
+
+    def advance(self, head, tail, food, occupied, action):
+        """
+        Moves the snake in given direction in constant time. Caller keeps
+        the body and updates it with the returned head, and removes the tail
+        unless the snake ate the food.
+        :param head: cell of the head.
+        :param tail: cell of the tail.
+        :param food: cell of the food or None.
+        :param occupied: bytearray with number of body segments in every
+        cell, it is updated by the move.
+        :param action: direction of the move, snake can not stop.
+        :return: cell of the new head, if the snake ate the food and if it died.
+        """
+        if not 0 <= action < 4:
+            raise ValueError("Snake can not move in direction {0}".format(action))
+        new_head = self.moves[4 * head + action]
+        ate = new_head == food
+        if not ate and tail >= 0:
+            occupied[tail] -= 1
+        if new_head < 0:
+            return new_head, ate, True
+        dead = occupied[new_head] > 0
+        occupied[new_head] += 1
+        return new_head, ate, dead
+
+    def index(self, position):
+        return position[1] * self.width + position[0]
+
+    def position(self, index):
+        return [index % self.width, index // self.width]
+
+
+# kernels for every board size in use
+KERNELS = {}
+
+
+def get_kernel(width, height):
+    """
+    :return: shared step kernel of the board size.
+    """
+    kernel = KERNELS.get((width, height))
+    if kernel is None:
+        kernel = KERNELS[width, height] = StepKernel(width, height)
+    return kernel
+
+
+def get_compact_state(game_state, food=None):
+    """
+    Encodes game state as compact state of the step kernel.
+    :param game_state: game state.
+    :param food: food position, food of the game state by default.
+    :return: tuple (body, food, direction).
+    """
+    kernel = game_state.kernel
+    if food is None:
+        food = game_state.food_spawn.food
+    return tuple(kernel.index(position) for position in game_state.snake.body), \
+        None if food is None else kernel.index(food), game_state.snake.direction
+
+
 class Snake:
     """
     Represents snake in the game. It contains information about snake body
@@ -37,12 +180,63 @@ class Snake:
             self.__head = [int(self.__board_size/2), int(self.__board_size/2)]
         else:
             self.__head = [int(self.__board_size/4), int(self.__board_size/4)]
-        self.__body = [[self.__head[0], self.__head[1]],
-                       [self.__head[0]-1, self.__head[1]],
-                       [self.__head[0]-2, self.__head[1]]]
+        self.__body = deque([[self.__head[0], self.__head[1]],
+                             [self.__head[0]-1, self.__head[1]],
+                             [self.__head[0]-2, self.__head[1]]])
+        self.__occupied = bytearray(self.__board_size * self.__board_size)
+        self.__collision = False
+        self.__eaten = False
         self.__direction = DIRECTION.RIGHT
+        self.__kernel = get_kernel(self.__board_size, self.__board_size)
         for point in self.__body:
-            self.__game_state.grid[point[0]][point[1]] = CellState.SNAKE_BODY
+            self.__occupy(point)
+            self.__game_state.grid.set(point[0], point[1], CellState.SNAKE_BODY)
+
+    def __cell(self, point):
+        """
+        :param point: x,y coordinates.
+        :return: cell index of the step kernel, -1 outside of the board.
+        """
+        if 0 <= point[0] < self.__board_size and 0 <= point[1] < self.__board_size:
+            return point[1] * self.__board_size + point[0]
+        return -1
+
+    def __occupy(self, point):
+        """
+        Marks cell as occupied by one more snake segment.
+        :param point: position of a segment.
+        :return: if cell was already occupied.
+        """
+        if 0 <= point[0] < self.__board_size and 0 <= point[1] < self.__board_size:
+            index = point[1] * self.__board_size + point[0]
+            self.__occupied[index] += 1
+            if self.__occupied[index] == 1:
+                self.__game_state.free_cells.remove(index)
+                return False
+            return True
+        return False
+
+    def __release(self, point):
+        """
+        Marks cell as occupied by one less snake segment.
+        :param point: position of a segment.
+        """
+        if 0 <= point[0] < self.__board_size and 0 <= point[1] < self.__board_size:
+            index = point[1] * self.__board_size + point[0]
+            self.__occupied[index] -= 1
+            if self.__occupied[index] == 0:
+                self.__game_state.free_cells.add(index)
+
+    def is_occupied(self, x, y):
+        """
+        Checks if snake body occupies a cell.
+        :param x: x coordinate of a cell.
+        :param y: y coordinate of a cell.
+        :return: is cell occupied.
+        """
+        if 0 <= x < self.__board_size and 0 <= y < self.__board_size:
+            return self.__occupied[y * self.__board_size + x] > 0
+        return False
 
     def change_direction(self, direction):
         """
@@ -64,51 +258,40 @@ class Snake:
 
     def move(self, food_position):
         """
-        Move the snake to the desired __direction by adding the food to that __direction.
-        and remove the tail if the snake does not eat food.
+        Move the snake to the desired __direction with the step kernel and
+        remove the tail if the snake does not eat food.
         :param food_position: current position of the food.
         :return: if snake food overlaps current food position.
         """
-        if self.__direction == DIRECTION.RIGHT:
-            self.__head[0] += 1
-        elif self.__direction == DIRECTION.LEFT:
-            self.__head[0] -= 1
-        elif self.__direction == DIRECTION.UP:
-            self.__head[1] -= 1
-        elif self.__direction == DIRECTION.DOWN:
-            self.__head[1] += 1
-        self.__body.insert(0, list(self.__head))
-        #  update game state
-        try:
-            self.__game_state.grid[self.__head[0]][self.__head[1]] = CellState.SNAKE_BODY
-        except KeyError:
-            pass
-
-        if self.__head == food_position:
-            return 1
-        else:
+        occupied = self.__occupied
+        food = None if food_position is None else self.__cell(food_position)
+        head, self.__eaten, self.__collision = self.__kernel.advance(
+            self.__cell(self.__head), self.__cell(self.__body[-1]), food, occupied, self.__direction)
+        if not self.__eaten:
             position = self.__body.pop()
+            tail = self.__cell(position)
+            if tail >= 0 and occupied[tail] == 0:
+                self.__game_state.free_cells.add(tail)
             try:
-                self.__game_state.grid[position[0]][position[1]] = CellState.EMPTY
+                self.__game_state.grid.set(position[0], position[1], CellState.EMPTY)
             except KeyError:
                 pass
-            return 0
+        self.__head = move_position(self.__head, self.__direction)
+        self.__body.appendleft(list(self.__head))
+        if head >= 0:
+            if occupied[head] == 1:
+                self.__game_state.free_cells.remove(head)
+            #  update game state
+            self.__game_state.grid.set(self.__head[0], self.__head[1], CellState.SNAKE_BODY)
+        return 1 if self.__eaten else 0
 
     def check_collision(self):
         """
         Checks is collision detected.
         :return: is collision detected.
         """
-        # Check if the _food collides with the edges of the board
-        if self.__head[0] >= self.__board_size or self.__head[0] < 0:
-            return True
-        elif self.__head[1] >= self.__board_size or self.__head[1] < 0:
-            return True
-        # Check if the _food collides with the body
-        for body in self.__body[1:]:
-            if self.__head == body:
-                return True
-        return False
+        # collision with the edges of the board or the body
+        return self.__collision
 
     @property
     def body(self):
@@ -116,13 +299,25 @@ class Snake:
 
     @body.setter
     def body(self, value):
-        self.__body = value
+        for point in self.__body:
+            self.__release(point)
+        self.__body = deque(value)
         self.__head = self.__body[0][:]
+        for i in range(1, len(self.__body)):
+            self.__occupy(self.__body[i])
+        self.__collision = self.__occupy(self.__head) or self.__cell(self.__head) < 0
 
     @property
     def head(self):
         return self.__head
 
+    @property
+    def eaten(self):
+        """
+        :return: if the snake ate the food in the last move.
+        """
+        return self.__eaten
+
     @property
     def direction(self):
         return self.__direction
@@ -146,21 +341,21 @@ class FoodSpawn:
         self.__game_state = game_state
         self.__is_food_on_map = False
         self._food = self.spawn_food(game_state.empty_cells())
-        self.__game_state.grid[self._food[0]][self._food[1]] = CellState.FOOD
+        self.__game_state.grid.set(self._food[0], self._food[1], CellState.FOOD)
 
     def spawn_food(self, points):
         """
         Choose random point for next food position.
-        :param points: tuples of x,y coordinates.
+        :param points: free cells of a game board.
         :return: randomly chosen point.
         """
         if not self.__is_food_on_map:
             try:
-                point = random.sample(points, 1)[0]
+                point = points.sample()
                 self._food = list(point)
                 self.__is_food_on_map = True
                 #  update game state
-                self.__game_state.grid[self._food[0]][self._food[1]] = CellState.FOOD
+                self.__game_state.grid.set(self._food[0], self._food[1], CellState.FOOD)
             except ValueError:
                 return None
         return self._food
@@ -177,11 +372,185 @@ class FoodSpawn:
         self._food = value
 
 
+class FreeCells:
+    """
+    Represents cells that are not occupied by the snake. Cells are kept
+    in an array together with the position of every cell in that array,
+    so cells can be added, removed (by swapping with the last cell) and
+    uniformly sampled in constant time.
+    """
+    def __init__(self, height, width):
+        """
+        Creates index with all cells free.
+        :param height: height of a game board.
+        :param width: width of a game board.
+        """
+        self.__width = width
+        self.__cells = list(range(height * width))
+        self.__positions = list(range(height * width))
+
+    def add(self, index):
+        """
+        Marks cell as free.
+        :param index: cell index, y * width + x.
+        """
+        if self.__positions[index] < 0:
+            self.__positions[index] = len(self.__cells)
+            self.__cells.append(index)
+
+    def remove(self, index):
+        """
+        Marks cell as occupied by swapping it with the last free cell.
+        :param index: cell index, y * width + x.
+        """
+        position = self.__positions[index]
+        if position >= 0:
+            last = self.__cells.pop()
+            if last != index:
+                self.__cells[position] = last
+                self.__positions[last] = position
+            self.__positions[index] = -1
+
+    def sample(self):
+        """
+        Uniformly chooses one free cell.
+        :return: tuple of x,y coordinates.
+        """
+        if not self.__cells:
+            raise ValueError("There are no free cells")
+        y, x = divmod(random.choice(self.__cells), self.__width)
+        return x, y
+
+    def __contains__(self, point):
+        x, y = point
+        index = y * self.__width + x
+        return 0 <= x < self.__width and 0 <= index < len(self.__positions) and self.__positions[index] >= 0
+
+    def __len__(self):
+        return len(self.__cells)
+
+    def __iter__(self):
+        return ((index % self.__width, index // self.__width) for index in self.__cells)
+
+
+class Grid:
+    """
+    Represents game board as flat array of cell states. Cell (x, y) is
+    stored at index y * width + x like cells of the step kernel. Cells can
+    be read and written as grid[x][y] like two dimensional dictionary, but
+    get and set should be used in hot paths because they do not create
+    column views.
+    """
+    def __init__(self, height, width, cells=None):
+        """
+        Creates empty grid or grid with given cells.
+        :param height: number of rows.
+        :param width: number of columns.
+        :param cells: bytearray of height * width cell states.
+        """
+        self.__height = height
+        self.__width = width
+        if cells is None:
+            self.__cells = bytearray(height * width)
+        else:
+            self.__cells = cells
+
+    def get(self, x, y):
+        """
+        Returns state of a cell.
+        :param x: column index.
+        :param y: row index.
+        :return: cell state.
+        """
+        if 0 <= x < self.__width and 0 <= y < self.__height:
+            return _CELL_STATES[self.__cells[y * self.__width + x]]
+        raise KeyError((x, y))
+
+    def set(self, x, y, value):
+        """
+        Changes state of a cell.
+        :param x: column index.
+        :param y: row index.
+        :param value: new cell state.
+        """
+        if 0 <= x < self.__width and 0 <= y < self.__height:
+            self.__cells[y * self.__width + x] = value
+        else:
+            raise KeyError((x, y))
+
+    def keys(self):
+        return range(self.__width)
+
+    def copy(self):
+        """
+        Copies grid in a single memory copy.
+        :return: new grid with the same cells.
+        """
+        return Grid(self.__height, self.__width, self.__cells[:])
+
+    def key(self):
+        """
+        Immutable snapshot of the grid that can be used as dictionary key.
+        :return: bytes of cell states.
+        """
+        return bytes(self.__cells)
+
+    def __getitem__(self, x):
+        if 0 <= x < self.__width:
+            return _GridColumn(self, x)
+        raise KeyError(x)
+
+    def __len__(self):
+        return self.__width
+
+    def __iter__(self):
+        return iter(range(self.__width))
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and self.__width == other.width and self.__cells == other.cells
+
+    __hash__ = None
+
+    @property
+    def height(self):
+        return self.__height
+
+    @property
+    def width(self):
+        return self.__width
+
+    @property
+    def cells(self):
+        return self.__cells
+
+
+class _GridColumn:
+    """
+    View of a single grid column used for grid[x][y] access.
+    """
+    __slots__ = ("__grid", "__column")
+
+    def __init__(self, grid, column):
+        self.__grid = grid
+        self.__column = column
+
+    def __getitem__(self, y):
+        return self.__grid.get(self.__column, y)
+
+    def __setitem__(self, y, value):
+        self.__grid.set(self.__column, y, value)
+
+    def keys(self):
+        return range(self.__grid.height)
+
+
+_CELL_STATES = tuple(CellState)
+
+
 class GameState:
     """
-    Represents game state. It game state is represented as two
-    dimensional dictionary of specific values for snake body and
-    food positions
+    Represents game state. It game state is represented as grid
+    of specific values for snake body and food positions
     """
     def __init__(self, height, width, food_spawn=None, snake=None):
         """
@@ -191,8 +560,9 @@ class GameState:
         """
         self.__height = height
         self.__width = width
-        self.__grid = {height: {column: CellState.EMPTY for column in range(self.__width)}
-                       for height in range(self.__height)}
+        self.__grid = Grid(self.__height, self.__width)
+        self.__free_cells = FreeCells(self.__height, self.__width)
+        self.__kernel = get_kernel(self.__width, self.__height)
 
         self.__snake = Snake(height, self)
         if snake is not None:
@@ -204,22 +574,23 @@ class GameState:
 
     def empty_cells(self):
         """
-        Available position in grid for next food spawn.
-        :return: dictionary of indexes in grid.
+        Available position in grid for next food spawn. Cells are
+        maintained by the snake, so no work is done on call.
+        :return: free cells of a game board.
         """
-        return {(i, j) for i in self.__grid.keys() for j in self.__grid[i].keys()
-                if [i, j] not in self.__snake.body}
+        return self.__free_cells
 
     def print_state(self):
         """
         Prints the current state of a game.
         """
-        for i in self.__grid.keys():
+        for y in range(self.__height):
             row = ""
-            for j in self.__grid[i].keys():
-                if self.__grid[i][j] == CellState.EMPTY:
+            for x in range(self.__width):
+                cell = self.__grid.get(x, y)
+                if cell == CellState.EMPTY:
                     row += "-"
-                elif self.__grid[i][j] == CellState.SNAKE_BODY:
+                elif cell == CellState.SNAKE_BODY:
                     row += "*"
                 else:
                     row += "o"
@@ -250,6 +621,14 @@ class GameState:
     def grid(self, value):
         self.__grid = value
 
+    @property
+    def free_cells(self):
+        return self.__free_cells
+
+    @property
+    def kernel(self):
+        return self.__kernel
+
     @property
     def snake(self):
         return self.__snake
@@ -280,19 +659,24 @@ class Problem(ABC):
         self.__game_state = game_state
         self.__snake = self.__game_state.snake
         self.__food = self.__game_state.food_spawn.food
+        self.__expanded_nodes = 0
 
     @abstractmethod
-    def get_successors(self, actions):
+    def get_successors(self, state):
         """
         Sequence of actions that can be executed in current state
         Actions are represents as triplets: (next_state, action, cost)
-        Next_state is represented as tuple of snake body positions.
-        In does not store information about food position because food
-        position stays the same
-        :param actions: previous actions.
+        States are compact states of the step kernel.
+        :param state: compact state.
         """
         pass
 
+    def get_start_state(self):
+        """
+        :return: compact state of current snake and food of the problem.
+        """
+        return get_compact_state(self.__game_state, self.__food)
+
     @abstractmethod
     def is_goal_state(self, state):
         """
@@ -323,6 +707,21 @@ class Problem(ABC):
     def game_state(self):
         return self.__game_state
 
+    @property
+    def kernel(self):
+        return self.__game_state.kernel
+
+    @property
+    def expanded_nodes(self):
+        """
+        Number of nodes expanded while searching for problem solution.
+        """
+        return self.__expanded_nodes
+
+    @expanded_nodes.setter
+    def expanded_nodes(self, value):
+        self.__expanded_nodes = value
+
 
 class Agent(ABC):
     """
@@ -340,20 +739,100 @@ class Agent(ABC):
         """
         pass
 
+    def close(self):
+        """
+        Releases resources of the agent, such as worker processes, when the game ends.
+        """
+        pass
+
+
+class StateEncoder(ABC):
+    """
+    Encodes game state as a key of Q-table.
+    """
+
+    @abstractmethod
+    def encode(self, game_state):
+        """
+        Encodes game state.
+        :param game_state: current state of a game.
+        :return: hashable state key.
+        """
+        pass
+
+    @property
+    def size(self):
+        """
+        Number of possible encoded states, None if states are not integers
+        from a bounded range.
+        """
+        return None
+
+
+class BodyStateEncoder(StateEncoder):
+    """
+    Encodes game state as flattened snake body positions and food position.
+    """
+
+    def encode(self, game_state):
+        return tuple(tuple(value for position in game_state.snake.body for value in position)), \
+               tuple(tuple(position for position in game_state.food_spawn.food))
+
+
+class FeatureStateEncoder(StateEncoder):
+    """
+    Encodes game state as small integer made of features that do not depend
+    on board size: current direction (2 bits), danger straight, left and right
+    of the head (3 bits), food up, down, left and right of the head (4 bits)
+    and tail left and up of the head (2 bits).
+    """
+    # straight, left and right direction relative to current direction
+    RELATIVE = {
+        DIRECTION.UP: (DIRECTION.UP, DIRECTION.LEFT, DIRECTION.RIGHT),
+        DIRECTION.DOWN: (DIRECTION.DOWN, DIRECTION.RIGHT, DIRECTION.LEFT),
+        DIRECTION.LEFT: (DIRECTION.LEFT, DIRECTION.DOWN, DIRECTION.UP),
+        DIRECTION.RIGHT: (DIRECTION.RIGHT, DIRECTION.UP, DIRECTION.DOWN),
+    }
+
+    def encode(self, game_state):
+        snake = game_state.snake
+        head = snake.head
+        tail = snake.body[-1]
+        direction = snake.direction
+        state = int(direction)
+        for relative in self.RELATIVE[direction]:
+            dx, dy = DELTAS[relative]
+            x, y = head[0] + dx, head[1] + dy
+            danger = x < 0 or x >= game_state.width or y < 0 or y >= game_state.height or \
+                (snake.is_occupied(x, y) and (x != tail[0] or y != tail[1]))
+            state = state << 1 | danger
+        food = game_state.food_spawn.food
+        if food is None:
+            state <<= 4
+        else:
+            state = state << 4 | (food[1] < head[1]) << 3 | (food[1] > head[1]) << 2 | \
+                (food[0] < head[0]) << 1 | (food[0] > head[0])
+        return state << 2 | (tail[0] < head[0]) << 1 | (tail[1] < head[1])
+
+    @property
+    def size(self):
+        return 1 << 11
+
 
 class Environment:
 
-    def __init__(self, game_state):
+    def __init__(self, game_state, encoder=None):
         self.game_state = game_state
+        self.encoder = BodyStateEncoder() if encoder is None else encoder
 
     def get_reward(self):
-        reward = -1
-        if self.game_state.snake.head == self.game_state.food_spawn.food:
-            reward = 20
+        # outcome of the last move is kept by the snake
+        reward = STEP_REWARD
+        if self.game_state.snake.eaten:
+            reward = FOOD_REWARD
         elif self.game_state.snake.check_collision():
-            reward = -20
+            reward = COLLISION_REWARD
         return reward
 
     def get_state(self):
-        return tuple(tuple(value for position in self.game_state.snake.body for value in position)), \
-               tuple(tuple(position for position in self.game_state.food_spawn.food))
+        return self.encoder.encode(self.game_state)
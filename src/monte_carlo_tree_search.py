@@ -1,7 +1,10 @@
+import json
 import random
-import datetime
+import time
+import multiprocessing
+from collections import deque
 from enum import IntEnum, unique
-from model import GameState, DIRECTION
+from model import DIRECTION, LEGAL_ACTIONS, get_compact_state, get_kernel
 from math import log, sqrt
 
 
@@ -12,42 +15,140 @@ class GameStatus(IntEnum):
     IN_PROGRESS = 2
 
 
-class Board:
+class ZobristKeys:
+    """
+    Random 64-bit keys of state parts for one board size. Key of a state is
+    XOR of the key of the head cell, link keys of other body cells, key of
+    the food and key of the direction. Link key of a body cell depends on
+    the direction towards the previous cell, so the order of the body is a
+    part of the key and one move changes only a constant number of keys.
+    Keys are generated from a fixed seed, so all processes use the same keys.
+    """
+    def __init__(self, width, height):
+        rng = random.Random(width * 100003 + height)
+        cells = width * height
+        self.width = width
+        # the last key is used for head that left the board and missing food
+        self.head = [rng.getrandbits(64) for _ in range(cells + 1)]
+        self.food = [rng.getrandbits(64) for _ in range(cells + 1)]
+        self.link = [rng.getrandbits(64) for _ in range(4 * cells)]
+        self.direction = [rng.getrandbits(64) for _ in range(len(DIRECTION))]
+
+    def link_direction(self, cell, previous):
+        """
+        :param cell: body cell.
+        :param previous: neighbouring body cell closer to the head.
+        :return: direction from cell to previous cell.
+        """
+        difference = previous - cell
+        if difference == 1:
+            return DIRECTION.RIGHT
+        elif difference == -1:
+            return DIRECTION.LEFT
+        elif difference == -self.width:
+            return DIRECTION.UP
+        return DIRECTION.DOWN
+
+    def state_key(self, body, food, direction):
+        """
+        Computes key of a state from scratch.
+        :param body: tuple of body cells, head first.
+        :param food: food cell or None.
+        :param direction: snake direction.
+        :return: 64-bit key.
+        """
+        key = self.head[body[0]] ^ self.food[-1 if food is None else food] ^ self.direction[direction]
+        for i in range(1, len(body)):
+            key ^= self.link[4 * body[i] + self.link_direction(body[i], body[i - 1])]
+        return key
+
+
+# Zobrist keys for every board size in use
+ZOBRIST_KEYS = {}
+
+
+def get_zobrist_keys(width, height):
+    """
+    :return: shared Zobrist keys of the board size.
+    """
+    keys = ZOBRIST_KEYS.get((width, height))
+    if keys is None:
+        keys = ZOBRIST_KEYS[width, height] = ZobristKeys(width, height)
+    return keys
+
 
+class Board:
+    """
+    Lightweight rollout engine that works directly on compact states.
+    State is compact state of the step kernel extended with Zobrist key:
+    (body, food, direction, key), where body is a tuple of cell indices
+    y * width + x with the head first, food is cell index of the food and
+    direction is current snake direction. Head that left the board is
+    stored as -1. Reaching the food ends the simulation.
+    """
     def __init__(self, game_state):
+        self.__width = game_state.width
+        self.__height = game_state.height
+        self.__kernel = get_kernel(game_state.width, game_state.height)
+        self.__keys = get_zobrist_keys(game_state.width, game_state.height)
         self.__start_state = get_state(game_state)
-        # use game state to update snake position
-        self.__game_state = GameState(game_state.height, game_state.width)
-        self.__game_state.food_spawn.food = game_state.food_spawn.food
 
     def next_state(self, state, action):
-        # copy last state in order to update
-        self.__game_state.food_spawn.food = state[1]
-        self.__game_state.snake.body = [[state[0][i], state[0][i + 1]]
-                                        for i in range(len(state[0])) if i % 2 == 0]
-        self.__game_state.snake.direction = action
-        # update current state with given action
-        self.__game_state.snake.move(self.__game_state.food_spawn.food)
-        return get_state(self.__game_state)
+        """
+        Moves the snake with the step kernel and updates the key of the state
+        for changed parts: head, direction, new link of the old head and
+        removed tail.
+        """
+        (body, food, _), ate, _ = self.__kernel.step(state, action)
+        old_body, direction, key = state[0], state[2], state[3]
+        old_head, head = old_body[0], body[0]
+        keys = self.__keys
+        key ^= keys.head[old_head] ^ keys.head[head] ^ keys.direction[direction] ^ keys.direction[action]
+        if ate:
+            key ^= keys.link[4 * old_head + action]
+        elif len(old_body) > 1:
+            tail = old_body[-1]
+            key ^= keys.link[4 * old_head + action] ^ keys.link[4 * tail + keys.link_direction(tail, old_body[-2])]
+        return body, food, action, key
 
     def get_legal_actions(self, state):
-        direction = state[-1]
-        self.__game_state.snake.change_direction(direction)
-        if direction == DIRECTION.UP:
-            return [DIRECTION.UP, DIRECTION.LEFT, DIRECTION.RIGHT]
-        elif direction == DIRECTION.DOWN:
-            return [DIRECTION.DOWN, DIRECTION.LEFT, DIRECTION.RIGHT]
-        elif direction == DIRECTION.LEFT:
-            return [DIRECTION.LEFT, DIRECTION.DOWN, DIRECTION.UP]
-        elif direction == DIRECTION.RIGHT:
-            return [DIRECTION.RIGHT, DIRECTION.DOWN, DIRECTION.UP]
+        return LEGAL_ACTIONS.get(state[2])
+
+    def rollout(self, state, moves, rng=random):
+        """
+        Plays random moves from given state until the game ends or moves run out.
+        Snake body is kept in a deque of cell indices together with an occupancy
+        array and moved in constant time by the step kernel, so no state is
+        created on the way.
+        :param state: state to start from.
+        :param moves: maximum number of moves.
+        :param rng: random number generator.
+        :return: final game status.
+        """
+        advance = self.__kernel.advance
+        body = deque(state[0])
+        food = state[1]
+        direction = state[2]
+        occupied = bytearray(self.__width * self.__height)
+        for cell in body:
+            occupied[cell] += 1
+        for _ in range(moves):
+            direction = rng.choice(LEGAL_ACTIONS[direction])
+            head, ate, dead = advance(body[0], body[-1], food, occupied, direction)
+            if ate:
+                return GameStatus.WIN
+            if dead:
+                return GameStatus.LOSE
+            body.pop()
+            body.appendleft(head)
+        return GameStatus.IN_PROGRESS
 
     def check_game_status(self, state):
-        self.__game_state.snake.body = [[state[0][i], state[0][i + 1]]
-                                        for i in range(len(state[0])) if i % 2 == 0]
-        if state[0][0] == state[1][0] and state[0][1] == state[1][1]:
+        body = state[0]
+        head = body[0]
+        if head == state[1]:
             return GameStatus.WIN
-        elif self.__game_state.snake.check_collision():
+        elif head < 0 or body.count(head) > 1:
             return GameStatus.LOSE
         else:
             return GameStatus.IN_PROGRESS
@@ -62,102 +163,396 @@ class Board:
 
 
 def get_state(game_state):
-    return tuple(tuple(value for position in game_state.snake.body for value in position)), \
-            tuple(tuple(position for position in game_state.food_spawn.food)), \
-            game_state.snake.direction
+    """
+    Encodes game state as compact state used by Board.
+    :param game_state: game state.
+    :return: tuple (body, food, direction, key).
+    """
+    body, food, direction = get_compact_state(game_state)
+    key = get_zobrist_keys(game_state.width, game_state.height).state_key(body, food, direction)
+    return body, food, direction, key
+
+
+class TranspositionTable(dict):
+    """
+    Statistics of tree nodes keyed by Zobrist keys of states. Node is a list
+    [plays, wins, children], where children maps action to the key of the
+    successor, or is None before a successor is added. When the table is
+    full, half of the nodes with the fewest plays are removed, except root.
+    """
+    def __init__(self, capacity=1000000):
+        """
+        :param capacity: maximum number of nodes.
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.root = None
+
+    def add(self, key):
+        """
+        Adds node with no statistics.
+        :param key: key of the state.
+        :return: new node.
+        """
+        if len(self) >= self.capacity:
+            self.evict()
+        node = [0, 0, None]
+        self[key] = node
+        return node
+
+    def evict(self):
+        """
+        Removes half of the nodes with the fewest plays.
+        """
+        ranked = sorted(self.items(), key=lambda item: item[1][0])
+        for key, _ in ranked[:max(1, len(ranked) // 2)]:
+            if key != self.root:
+                del self[key]
+
+    def retain(self, keys):
+        """
+        Removes all nodes except given ones.
+        :param keys: keys of nodes to keep.
+        """
+        for key in [key for key in self if key not in keys]:
+            del self[key]
+
+
+class SearchStatistics:
+    """
+    Statistics of one search: number of simulations, duration in seconds,
+    number of states in the tree, maximum depth reached and (action, visits,
+    value) for every legal action, where value is average reward.
+    """
+    def __init__(self, simulations, duration, tree_size, max_depth, actions):
+        self.simulations = simulations
+        self.duration = duration
+        self.tree_size = tree_size
+        self.max_depth = max_depth
+        self.actions = actions
+
+    @property
+    def simulations_per_second(self):
+        return self.simulations / self.duration if self.duration > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "simulations": self.simulations,
+            "duration": self.duration,
+            "simulations_per_second": self.simulations_per_second,
+            "tree_size": self.tree_size,
+            "max_depth": self.max_depth,
+            "actions": [{"action": int(action), "visits": visits, "value": value}
+                        for action, visits, value in self.actions],
+        }
+
+
+class StatisticsSink:
+    """
+    Receives statistics of every search.
+    """
+    def add(self, statistics):
+        pass
+
+    def close(self):
+        pass
+
+
+class AggregateFileSink(StatisticsSink):
+    """
+    Aggregates statistics of all searches and writes them to a JSON file
+    when closed.
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the file.
+        """
+        self.__path = path
+        self.__searches = 0
+        self.__simulations = 0
+        self.__duration = 0.0
+        self.__tree_size = 0
+        self.__max_tree_size = 0
+        self.__max_depth = 0
+
+    def add(self, statistics):
+        self.__searches += 1
+        self.__simulations += statistics.simulations
+        self.__duration += statistics.duration
+        self.__tree_size += statistics.tree_size
+        self.__max_tree_size = max(self.__max_tree_size, statistics.tree_size)
+        self.__max_depth = max(self.__max_depth, statistics.max_depth)
+
+    def summary(self):
+        """
+        :return: dictionary of aggregated statistics.
+        """
+        searches = max(self.__searches, 1)
+        return {
+            "searches": self.__searches,
+            "simulations": self.__simulations,
+            "duration": self.__duration,
+            "simulations_per_second": self.__simulations / self.__duration if self.__duration > 0 else 0.0,
+            "mean_simulations": self.__simulations / searches,
+            "mean_tree_size": self.__tree_size / searches,
+            "max_tree_size": self.__max_tree_size,
+            "max_depth": self.__max_depth,
+        }
+
+    def close(self):
+        with open(self.__path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
 
 
 class MonteCarloTreeSearch:
 
     def __init__(self, board, **kwargs):
+        """
+        :param board: game board.
+        :param kwargs: c (exploration constant), time (milliseconds per action),
+        simulations (number of simulations per action, replaces time),
+        seed (seed of own random number generator), max_moves, workers,
+        pool (process pool of workers - 1 processes that outlives the search,
+        the search creates and closes its own pool by default), sink
+        (receives statistics of every search) and table_size (maximum number
+        of nodes in the tree).
+        """
         self.board = board
         self.c = kwargs.get("c", 1.41)
-        self.wins = {}
-        self.plays = {}
+        self.table = TranspositionTable(kwargs.get("table_size", 1000000))
+        self.table.root = board.start_state[3]
         self.max_depth = 0
         self.states = [board.start_state]
-        self.time = datetime.timedelta(milliseconds=kwargs.get("time", 140))
+        self.time = kwargs.get("time", 140)
+        self.simulations = kwargs.get("simulations", None)
+        seed = kwargs.get("seed", None)
+        self.random = random if seed is None else random.Random(seed)
         self.max_moves = kwargs.get("max_moves", 100)
+        self.workers = kwargs.get("workers", 1)
+        self.sink = kwargs.get("sink", None)
+        self.__pool = kwargs.get("pool", None)
+        self.__own_pool = self.__pool is None
+
+    def update(self, state):
+        """
+        Moves the root of the tree to the state reached after an action and
+        removes statistics of states that can not be reached from it any more.
+        Statistics of the remaining states are reused by next search.
+        :param state: new current state of a game.
+        """
+        self.states = [state]
+        self.board.start_state = state
+        self.table.root = state[3]
+        reachable = set()
+        stack = [state[3]]
+        while stack:
+            key = stack.pop()
+            if key not in reachable:
+                reachable.add(key)
+                node = self.table.get(key)
+                if node is not None and node[2] is not None:
+                    stack.extend(node[2].values())
+        self.table.retain(reachable)
 
     def get_action(self):
+        action, _ = self.search()
+        return action
+
+    def search(self):
+        """
+        Searches for the best action from the current state.
+        :return: action and statistics of the search.
+        """
         self.max_depth = 0
         current_state = self.states[-1]
-        legal = self.board.get_legal_actions(current_state)
+        if current_state[3] not in self.table:
+            self.table.add(current_state[3])
+
+        begin = time.perf_counter_ns()
+        if self.workers > 1:
+            games = self.run_parallel_simulations()
+        else:
+            games = self.run_simulations()
+        duration = (time.perf_counter_ns() - begin) / 1e9
+
+        successors = self.get_successors(current_state)
+        percent_wins, action = self.choose_action(successors)
+
+        statistics = SearchStatistics(games, duration, len(self.table), self.max_depth,
+                                      [(a, node[0] if node else 0, node[1] / node[0] if node and node[0] else 0.0)
+                                       for a, node in successors])
+        if self.sink is not None:
+            self.sink.add(statistics)
+        return action, statistics
 
+    def run_simulations(self, deadline=None):
+        """
+        Runs given number of simulations, or simulations until time runs out
+        when number is not set.
+        :param deadline: end of the search in nanoseconds of time.monotonic_ns,
+        by default time of the search after now.
+        :return: number of simulations.
+        """
+        if self.simulations is not None:
+            for _ in range(self.simulations):
+                self.run_simulation()
+            return self.simulations
         games = 0
-        begin = datetime.datetime.utcnow()
-        while datetime.datetime.utcnow() - begin < self.time:
+        end = time.monotonic_ns() + self.time * 1000000 if deadline is None else deadline
+        while time.monotonic_ns() < end:
             self.run_simulation()
             games += 1
+        return games
 
-        states = [self.board.next_state(current_state, p) for p in legal]
-        print("Games: {0}, Duration: {1}".format(games, datetime.datetime.utcnow() - begin))
+    def run_parallel_simulations(self):
+        """
+        Runs independent searches from the root in worker processes while
+        this process runs its own simulations (root parallelization).
+        Statistics of root successors are merged into this tree.
+        :return: number of simulations in all processes.
+        """
+        # all processes stop at the same time, monotonic clock is shared by processes
+        deadline = time.monotonic_ns() + self.time * 1000000
+        if self.__pool is None:
+            self.__pool = multiprocessing.Pool(self.workers - 1)
+        tasks = [(type(self), self.board, deadline, self.simulations, self.max_moves, self.c,
+                  self.random.randrange(2 ** 32)) for _ in range(self.workers - 1)]
+        result = self.__pool.map_async(search_root, tasks)
+        games = self.run_simulations(deadline)
+
+        root = self.table[self.states[-1][3]]
+        for worker_games, max_depth, statistics in result.get():
+            games += worker_games
+            self.max_depth = max(self.max_depth, max_depth)
+            for action, key, plays, wins in statistics:
+                node = self.table.get(key)
+                if node is None:
+                    node = self.table.add(key)
+                node[0] += plays
+                node[1] += wins
+                if root[2] is None:
+                    root[2] = {}
+                root[2][action] = key
+        return games
+
+    def close(self):
+        """
+        Stops worker processes of own pool.
+        """
+        if self.__pool is not None and self.__own_pool:
+            self.__pool.terminate()
+            self.__pool.join()
+        self.__pool = None
 
-        percent_wins, action = self.choose_action(states)
+    def __enter__(self):
+        return self
 
-        # print stats
-        for x in sorted(((100 * self.wins.get(s, 0) / self.plays.get(s, 1), self.wins.get(s, 0),
-                          self.plays.get(s, 0), s[2]) for s in states), reverse=True):
-            print("{3}: {0:.2f}% ({1} / {2})".format(*x))
-        print("Maximum max_depth searched:", self.max_depth)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        return action
+    def get_successors(self, state):
+        """
+        :param state: state in the tree.
+        :return: list of (action, node) for legal actions, node is None
+        for successors that are not in the tree.
+        """
+        node = self.table.get(state[3])
+        children = node[2] if node is not None and node[2] is not None else {}
+        return [(action, self.table.get(children.get(action))) for action in self.board.get_legal_actions(state)]
 
     def run_simulation(self):
-        plays, wins = self.plays, self.wins
-        visited = set()
-        states_copy = self.states[:]
-        state = states_copy[-1]
+        table, board, rng = self.table, self.board, self.random
+        state = self.states[-1]
+        parent = table.get(state[3])
+        visited = {}
 
         expand = True
         status = GameStatus.IN_PROGRESS
         for i in range(1, self.max_moves + 1):
-            legal = self.board.get_legal_actions(states_copy[-1])
-            states = [self.board.next_state(state, p) for p in legal]
-
-            if all(plays.get(s) for s in states):
+            legal = board.get_legal_actions(state)
+            children = parent[2] if parent is not None else None
+            successors = None
+            if children is not None and len(children) == len(legal):
+                # all successors are known, check if they are still in the table
+                successors = [(action, table.get(key)) for action, key in children.items()]
+                for _, node in successors:
+                    if node is None or not node[0]:
+                        successors = None
+                        break
+
+            if successors is not None:
                 # if we have stats on all of the legal moves, use UCT.
-                _, action, state = self.calculate_utc(states)
+                _, action, _ = self.calculate_utc(successors)
             else:
                 # otherwise, make an random decision.
-                state = random.choice(states)
-
-            states_copy.append(state)
+                action = rng.choice(legal)
 
-            if expand and state not in self.plays:
+            state = board.next_state(state, action)
+            node = table.get(state[3])
+            if expand and node is None:
                 expand = False
-                self.plays[state] = 0
-                self.wins[state] = 0
+                node = table.add(state[3])
                 if i > self.max_depth:
                     self.max_depth = i
-
-            visited.add(state)
-            status = self.board.check_game_status(state)
+            if node is not None:
+                if parent is not None:
+                    # remember tree edges, so unreachable states can be pruned
+                    if parent[2] is None:
+                        parent[2] = {}
+                    parent[2][action] = state[3]
+                visited[state[3]] = node
+            parent = node
+
+            status = board.check_game_status(state)
             if status == GameStatus.WIN or status == GameStatus.LOSE:
                 break
+            if not expand:
+                # new node is added to the tree, play the rest of the game randomly
+                status = board.rollout(state, self.max_moves - i, rng)
+                break
 
-        for state in visited:
-            if state in plays:
-                plays[state] += 1
-                self.calculate_reward(state, status)
+        for node in visited.values():
+            node[0] += 1
+            self.calculate_reward(node, status)
 
-    def calculate_reward(self, state, status):
+    def calculate_reward(self, node, status):
         if status == GameStatus.WIN:
-            self.wins[state] += 1
+            node[1] += 1
 
-    def calculate_utc(self, states):
-        plays, wins = self.plays, self.wins
-        total_log = log(sum(plays[s] for s in states))
-        return max(((wins[s] / plays[s]) + self.c * sqrt(total_log / plays[s]), s[2], s) for s in states)
+    def calculate_utc(self, successors):
+        """
+        :param successors: list of (action, node), every node has plays.
+        :return: UCT value, action and node of the best successor.
+        """
+        total_log = log(sum(node[0] for _, node in successors))
+        c = self.c
+        return max((node[1] / node[0] + c * sqrt(total_log / node[0]), action, node) for action, node in successors)
 
-    def choose_action(self, states):
+    def choose_action(self, successors):
         """
         Choose next action
-        :param states: next available states
+        :param successors: list of (action, node) for next available states
         :return: percent wins, action
         """
         # pick the move with the highest percentage of wins.
-        return max((self.wins.get(s, 0) / self.plays.get(s, 1), s[2]) for s in states)
+        return max((node[1] / node[0] if node is not None and node[0] else 0, action) for action, node in successors)
+
+
+def search_root(task):
+    """
+    Runs independent search from the root of a board in worker process.
+    :param task: tuple (search class, board, deadline in nanoseconds of time.monotonic_ns,
+    number of simulations, max moves, c, random seed).
+    :return: number of simulations, maximum depth and (action, key, plays, wins)
+    for every successor of the root.
+    """
+    search_class, board, deadline, simulations, max_moves, c, seed = task
+    search = search_class(board, simulations=simulations, max_moves=max_moves, c=c, seed=seed)
+    root = search.table.add(board.start_state[3])
+    games = search.run_simulations(deadline)
+    children = root[2] or {}
+    return games, search.max_depth, [(action, key, search.table[key][0], search.table[key][1])
+                                     for action, key in children.items() if key in search.table]
 
 
 class MonteCarloQLearning(MonteCarloTreeSearch):
@@ -177,24 +572,27 @@ class MonteCarloQLearning(MonteCarloTreeSearch):
         self.alpha = kwargs.get("alpha", 0.3)
         self.gamma = kwargs.get("gamma", 0.1)
 
-    def calculate_reward(self, state, status):
+    def calculate_reward(self, node, status):
         if status == GameStatus.WIN:
-            self.wins[state] += 20
+            node[1] += 20
         elif status == GameStatus.LOSE:
-            self.wins[state] -= 20
+            node[1] -= 20
         else:
-            self.wins[state] -= 1
+            node[1] -= 1
 
-    def choose_action(self, states):
+    def choose_action(self, successors):
         state = self.current_state[0], self.current_state[1]
         if state not in self.q_table:
-            self.q_table[state] = {ac: 0 for ac in [s[2] for s in states]}
-
-        next_max, next_max_action, next_max_state = self.calculate_utc(states)
-        for action, old_q_value in self.q_table[state].items():
-            for s in states:
-                if s[2] == action:
-                    new_q_value = (1 - self.alpha) * old_q_value + self.alpha * \
-                                  (self.wins[s] + self.gamma * next_max)
-                    self.q_table[state][action] = new_q_value
-        return self.wins.get(next_max_state, 0) / self.plays.get(next_max_state, 1), next_max_action
+            self.q_table[state] = {ac: 0 for ac, _ in successors}
+
+        # small budget can leave successors without plays, they keep their Q values
+        successors = [(action, node) for action, node in successors if node is not None and node[0]]
+        if not successors:
+            return 0, self.random.choice(self.board.get_legal_actions(self.states[-1]))
+        next_max, next_max_action, next_max_node = self.calculate_utc(successors)
+        q_values = self.q_table[state]
+        for action, node in successors:
+            if action in q_values:
+                q_values[action] = (1 - self.alpha) * q_values[action] + self.alpha * \
+                                   (node[1] + self.gamma * next_max)
+        return next_max_node[1] / next_max_node[0], next_max_action
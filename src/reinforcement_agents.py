@@ -1,32 +1,457 @@
 from model import *
 import monte_carlo_tree_search as mc
+import multiprocessing
 import operator
 import random
+import os
 import pickle
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class QTable:
+    """
+    Q values stored in dictionary of dictionaries keyed by state and action.
+    Actions of a state are added with zero value on its first visit.
+    """
+    def __init__(self):
+        self.table = {}
+
+    def get_values(self, state, actions):
+        """
+        Q values of a state.
+        :param state: state key.
+        :param actions: legal actions in the state.
+        :return: dictionary of action and Q value.
+        """
+        values = self.table.get(state)
+        if values is None:
+            values = self.table[state] = {ac: 0 for ac in actions}
+        elif len(values) < len(actions):
+            # state was only set by merged values of other tables
+            for ac in actions:
+                values.setdefault(ac, 0)
+        return values
+
+    def get_value(self, state, action):
+        return self.table[state][action]
+
+    def set_value(self, state, action, value):
+        values = self.table.get(state)
+        if values is None:
+            values = self.table[state] = {}
+        values[action] = value
+
+    def save(self, path):
+        """
+        Saves the table.
+        :param path: file path without extension.
+        """
+        with open(path + ".pickle", "wb+") as file:
+            pickle.dump(self.table, file)
+
+    def load(self, path):
+        """
+        Loads the table. Table saved by other backend, e.g. dense table of
+        encoded states, is ignored.
+        :param path: file path without extension.
+        """
+        with open(path + ".pickle", "rb") as file:
+            table = pickle.load(file)
+        if isinstance(table, dict):
+            self.table = table
+
+
+class DenseQTable(QTable):
+    """
+    Q values stored in contiguous float32 array indexed by integer state
+    and action, for state encoders with bounded number of states.
+    """
+    ACTIONS = 4
+
+    def __init__(self, size):
+        """
+        Creates table with all Q values set to zero.
+        :param size: number of states.
+        """
+        super().__init__()
+        self.table = array("f", bytes(4 * size * self.ACTIONS))
+
+    def get_values(self, state, actions):
+        index = state * self.ACTIONS
+        return {ac: self.table[index + ac] for ac in actions}
+
+    def get_value(self, state, action):
+        return self.table[state * self.ACTIONS + action]
+
+    def set_value(self, state, action, value):
+        self.table[state * self.ACTIONS + action] = value
+
+    def load(self, path):
+        with open(path + ".pickle", "rb") as file:
+            table = pickle.load(file)
+        if len(table) == len(self.table):
+            self.table = table
+
+
+class InternedQTable(QTable):
+    """
+    Q values of unbounded states. Every state is interned into integer id
+    on its first visit and values are stored in contiguous float32 array
+    indexed by id and action. Table is saved as .npy file with values and
+    .index file with states ordered by id. Loaded values are memory mapped
+    and both files are read on the first access, so creating an agent does
+    not depend on the size of the table. The index is a single pickle that
+    is read whole on the first access, so its cost is postponed, not avoided.
+    """
+    ACTIONS = 4
+
+    def __init__(self, capacity=1024):
+        """
+        Creates empty table.
+        :param capacity: initial number of states.
+        """
+        super().__init__()
+        self.__ids = {}
+        self.__states = []
+        self.__values = np.zeros(capacity * self.ACTIONS, dtype=np.float32)
+        self.__path = None
+
+    def get_values(self, state, actions):
+        index = self.__intern(state) * self.ACTIONS
+        values = self.__values[index:index + self.ACTIONS].tolist()
+        return {ac: values[ac] for ac in actions}
+
+    def get_value(self, state, action):
+        # reading and interning can replace the array, so id is found first
+        index = self.__intern(state) * self.ACTIONS + action
+        return float(self.__values[index])
+
+    def set_value(self, state, action, value):
+        index = self.__intern(state) * self.ACTIONS + action
+        self.__values[index] = value
+
+    def save(self, path):
+        """
+        Saves the table. Files are written under temporary names and then
+        replace the old ones, so the table can be saved to the path it was
+        loaded from and a failed save keeps the previous table.
+        :param path: file path without extension.
+        """
+        self.__read()
+        # memory mapped values are copied, because the mapped file is replaced
+        self.__values = np.array(self.__values)
+        with open(path + ".npy.tmp", "wb") as file:
+            np.save(file, self.__values[:len(self.__states) * self.ACTIONS])
+        with open(path + ".index.tmp", "wb") as file:
+            pickle.dump(self.__states, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".npy.tmp", path + ".npy")
+        os.replace(path + ".index.tmp", path + ".index")
+
+    def load(self, path):
+        """
+        Loads the table on its first access. Table saved by dictionary
+        backend is converted right away and table saved by dense backend
+        is ignored.
+        :param path: file path without extension.
+        """
+        if os.path.exists(path + ".npy") and os.path.exists(path + ".index"):
+            self.__path = path
+            return
+        with open(path + ".pickle", "rb") as file:
+            table = pickle.load(file)
+        if not isinstance(table, dict):
+            return
+        self.__ids, self.__states, self.__path = {}, [], None
+        for state, values in table.items():
+            for action, value in values.items():
+                self.set_value(state, action, value)
+
+    def __read(self):
+        """
+        Reads files of the table if they are not read yet.
+        """
+        if self.__path is None:
+            return
+        path, self.__path = self.__path, None
+        # copy on write keeps saved table unchanged
+        self.__values = np.load(path + ".npy", mmap_mode="c")
+        with open(path + ".index", "rb") as file:
+            self.__states = pickle.load(file)
+        self.__ids = {state: i for i, state in enumerate(self.__states)}
+
+    def __intern(self, state):
+        """
+        Finds id of a state, new states get next free id.
+        :param state: state key.
+        :return: id of the state.
+        """
+        if self.__path is not None:
+            self.__read()
+        i = self.__ids.get(state)
+        if i is None:
+            i = len(self.__states)
+            if (i + 1) * self.ACTIONS > len(self.__values):
+                values = np.zeros(max(2 * len(self.__values), self.ACTIONS), dtype=np.float32)
+                values[:len(self.__values)] = self.__values
+                self.__values = values
+            self.__ids[state] = i
+            self.__states.append(state)
+        return i
+
+    def __len__(self):
+        self.__read()
+        return len(self.__states)
+
+
+def save_q_table(q_table, path):
+    """
+    Saves Q-table and creates its directory if it does not exist.
+    :param q_table: Q-table.
+    :param path: file path without extension.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    q_table.save(path)
+
+
+class Schedule(ABC):
+    """
+    Value of a learning parameter that depends on the number of training steps.
+    """
+    @abstractmethod
+    def value(self, step):
+        pass
+
+
+class ConstantSchedule(Schedule):
+
+    def __init__(self, value):
+        self.__value = value
+
+    def value(self, step):
+        return self.__value
+
+
+class LinearSchedule(Schedule):
+    """
+    Value changes linearly from start to end in given number of steps
+    and stays at end after that.
+    """
+    def __init__(self, start, end, steps):
+        self.__start = start
+        self.__end = end
+        self.__steps = steps
+
+    def value(self, step):
+        if step >= self.__steps:
+            return self.__end
+        return self.__start + (self.__end - self.__start) * step / self.__steps
+
+
+class ExponentialSchedule(Schedule):
+    """
+    Value decays from start by given rate every step until it reaches end.
+    """
+    def __init__(self, start, end, decay):
+        self.__start = start
+        self.__end = end
+        self.__decay = decay
+
+    def value(self, step):
+        return max(self.__end, self.__start * self.__decay ** step)
+
+
+def get_schedule(value):
+    """
+    :param value: number or schedule.
+    :return: schedule, constant schedule for number.
+    """
+    if isinstance(value, Schedule):
+        return value
+    return ConstantSchedule(value)
+
+
+class ReplayBuffer:
+    """
+    Fixed size ring buffer of transitions. Actions, rewards and directions of
+    the snake after the transition are stored in arrays, states in preallocated
+    lists. When the buffer is full the oldest transition is overwritten.
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: maximum number of transitions.
+        """
+        self.__capacity = capacity
+        self.__states = [None] * capacity
+        self.__next_states = [None] * capacity
+        self.__actions = array("b", bytes(capacity))
+        self.__directions = array("b", bytes(capacity))
+        self.__rewards = array("f", bytes(4 * capacity))
+        self.__position = 0
+        self.__size = 0
+
+    def add(self, state, action, reward, next_state, direction):
+        """
+        Adds transition to the buffer.
+        :param state: state key.
+        :param action: action taken in the state.
+        :param reward: received reward.
+        :param next_state: key of the next state.
+        :param direction: direction of the snake in the next state.
+        """
+        i = self.__position
+        self.__states[i] = state
+        self.__actions[i] = action
+        self.__rewards[i] = reward
+        self.__next_states[i] = next_state
+        self.__directions[i] = direction
+        self.__position = (i + 1) % self.__capacity
+        if self.__size < self.__capacity:
+            self.__size += 1
+
+    def sample(self, count):
+        """
+        Samples transitions uniformly with replacement.
+        :param count: number of transitions.
+        :return: list of (state, action, reward, next state, direction) tuples.
+        """
+        transitions = []
+        for _ in range(count):
+            i = random.randrange(self.__size)
+            transitions.append((self.__states[i], self.__actions[i], self.__rewards[i],
+                                self.__next_states[i], self.__directions[i]))
+        return transitions
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+
+class PolicyCache:
+    """
+    Decides when Q values of a state are reliable enough to act on them
+    without search. State is confident when it was updated at least
+    min_visits times, its Q values stopped changing and its best action
+    leads by at least min_margin.
+    """
+    def __init__(self, min_visits=10, tolerance=0.5, min_margin=0.0):
+        """
+        :param min_visits: number of updates of a state before it is trusted.
+        :param tolerance: average absolute change of Q value of converged state.
+        :param min_margin: difference between the best and the second best Q value.
+        """
+        self.min_visits = min_visits
+        self.tolerance = tolerance
+        self.min_margin = min_margin
+        # state: [number of updates, moving average of absolute changes]
+        self.__visits = {}
+        self.hits = 0
+        self.misses = 0
+
+    def visit(self, state, change):
+        """
+        Counts update of a state.
+        :param state: state key.
+        :param change: change of the updated Q value.
+        """
+        visits = self.__visits.get(state)
+        if visits is None:
+            self.__visits[state] = [1, abs(change)]
+        else:
+            visits[0] += 1
+            visits[1] = 0.8 * visits[1] + 0.2 * abs(change)
+
+    def get_action(self, state, q_values):
+        """
+        Best action of a confident state.
+        :param state: state key.
+        :param q_values: dictionary of action and Q value.
+        :return: action with the highest Q value, None if state is not confident.
+        """
+        visits = self.__visits.get(state)
+        if visits is not None and visits[0] >= self.min_visits and visits[1] <= self.tolerance:
+            ranked = sorted(q_values.values(), reverse=True)
+            if len(ranked) == 1 or ranked[0] - ranked[1] >= self.min_margin:
+                self.hits += 1
+                return max(q_values.items(), key=operator.itemgetter(1))[0]
+        self.misses += 1
+        return None
+
+    def __len__(self):
+        return len(self.__visits)
 
 
 class ReinforcementAgent(Agent):
 
-    def __init__(self, environment, alpha=0.3, gamma=0.1, epsilon=0.1):
+    def __init__(self, environment, alpha=0.3, gamma=0.1, epsilon=0.1, replay_size=0, replay_batch=32,
+                 replay_every=4):
+        """
+        :param environment: environment of the agent.
+        :param alpha: learning rate, number or schedule.
+        :param gamma: discount factor.
+        :param epsilon: exploration rate, number or schedule.
+        :param replay_size: capacity of experience replay buffer, 0 disables replay.
+        :param replay_batch: number of transitions replayed at once.
+        :param replay_every: number of steps between replays.
+        """
         self.__environment = environment
-        self.q_table = {}
+        self.q_table = self.create_q_table()
         self.reward = 0
-        self.alpha = alpha
+        self.alpha_schedule = get_schedule(alpha)
+        self.epsilon_schedule = get_schedule(epsilon)
+        self.training_steps = 0
+        self.alpha = self.alpha_schedule.value(0)
         self.gamma = gamma
-        self.epsilon = epsilon
+        self.epsilon = self.epsilon_schedule.value(0)
+        self.replay_buffer = ReplayBuffer(replay_size) if replay_size > 0 else None
+        self.replay_batch = replay_batch
+        self.replay_every = replay_every
         self.state = self.__environment.get_state()
         self.current_action = self.__environment.game_state.snake.direction
         self.current_reward = 0.0
 
     def get_legal_actions(self):
-        if self.__environment.game_state.snake.direction == DIRECTION.UP:
-            return [DIRECTION.UP, DIRECTION.LEFT, DIRECTION.RIGHT]
-        elif self.__environment.game_state.snake.direction == DIRECTION.DOWN:
-            return [DIRECTION.DOWN, DIRECTION.LEFT, DIRECTION.RIGHT]
-        elif self.__environment.game_state.snake.direction == DIRECTION.LEFT:
-            return [DIRECTION.LEFT, DIRECTION.DOWN, DIRECTION.UP]
-        elif self.__environment.game_state.snake.direction == DIRECTION.RIGHT:
-            return [DIRECTION.RIGHT, DIRECTION.DOWN, DIRECTION.UP]
+        return LEGAL_ACTIONS[self.__environment.game_state.snake.direction]
+
+    def learn(self, state, action, reward, next_state, next_actions):
+        """
+        Q-learning update for one transition.
+        :param state: state key.
+        :param action: action taken in the state.
+        :param reward: received reward.
+        :param next_state: key of the next state.
+        :param next_actions: legal actions in the next state.
+        """
+        old_q_value = self.q_table.get_value(state, action)
+
+        # maximum q value for next state actions
+        next_max = max(self.q_table.get_values(next_state, next_actions).values())
+
+        new_q_value = (1 - self.alpha) * old_q_value + self.alpha * (reward + self.gamma * next_max)
+        self.q_table.set_value(state, action, new_q_value)
+
+    def step_schedules(self):
+        """
+        Advances learning parameters by one training step.
+        """
+        self.training_steps += 1
+        self.alpha = self.alpha_schedule.value(self.training_steps)
+        self.epsilon = self.epsilon_schedule.value(self.training_steps)
+
+    def replay(self):
+        """
+        Learns again from a batch of stored transitions.
+        """
+        for state, action, reward, next_state, direction in self.replay_buffer.sample(self.replay_batch):
+            self.learn(state, action, reward, next_state, LEGAL_ACTIONS[direction])
 
     @abstractmethod
     def get_next_action(self):
@@ -36,6 +461,19 @@ class ReinforcementAgent(Agent):
     def update(self):
         pass
 
+    def create_q_table(self):
+        """
+        Creates Q-table that fits the state encoder of the environment.
+        :return: dense table for bounded states, otherwise interned table or
+        dictionary table when numpy is not installed.
+        """
+        size = self.__environment.encoder.size
+        if size is not None:
+            return DenseQTable(size)
+        if np is not None:
+            return InternedQTable()
+        return QTable()
+
     def reset(self):
         self.reward = 0
 
@@ -51,84 +489,131 @@ class ReinforcementAgent(Agent):
 
 class QAgent(ReinforcementAgent):
 
-    def __init__(self, environment):
-        super().__init__(environment)
+    def __init__(self, environment, **kwargs):
+        super().__init__(environment, **kwargs)
+        self.table_path = self.get_table_path()
         try:
-            with open("files/q_agent_{0}x{0}.pickle".format(environment.game_state.height), "rb") as file:
-                self.q_table = pickle.load(file)
+            self.q_table.load(self.table_path)
         except(FileNotFoundError, FileExistsError):
-            self.q_table = {}
+            pass
+
+    def get_table_path(self):
+        """
+        Tables of different state encoders are kept in different files,
+        because their states and table types differ.
+        :return: file path of the Q-table without extension.
+        """
+        if self.environment.encoder.size is None:
+            return "files/q_agent_{0}x{0}".format(self.environment.game_state.height)
+        # encoded states do not depend on board size
+        return "files/q_agent_features"
 
     def get_next_action(self):
         self.state = self.environment.get_state()
         legal_actions = self.get_legal_actions()
-
-        if self.state not in self.q_table:
-            self.q_table[self.state] = {ac: 0 for ac in legal_actions}
+        q_values = self.q_table.get_values(self.state, legal_actions)
 
         action = random.choice(legal_actions)
 
         # exploration vs. exploitation
         if random.random() > self.epsilon:
-            if not len(set(self.q_table[self.state].values())) == 1:
-                maximum = max(self.q_table[self.state].items(), key=operator.itemgetter(1))[1]
-                action = random.choice([action for action, value in self.q_table[self.state].items()
+            if not len(set(q_values.values())) == 1:
+                maximum = max(q_values.items(), key=operator.itemgetter(1))[1]
+                action = random.choice([action for action, value in q_values.items()
                                         if value == maximum])
         return action
 
     def update(self):
-        legal_actions = self.get_legal_actions()
         next_state = self.environment.get_state()
-
-        # check if next_state already has q values
-        if next_state not in self.q_table:
-            self.q_table[next_state] = {ac: 0 for ac in legal_actions}
-
-        old_q_value = self.q_table[self.state][self.current_action]
-
-        # maximum q value for next state actions
-        next_max = max(self.q_table[next_state].values())
-
-        new_q_value = (1 - self.alpha) * old_q_value + self.alpha * \
-                      (self.current_reward + self.gamma * next_max)
-        self.q_table[self.state][self.current_action] = new_q_value
+        self.learn(self.state, self.current_action, self.current_reward, next_state, self.get_legal_actions())
+        if self.replay_buffer is not None:
+            self.replay_buffer.add(self.state, self.current_action, self.current_reward, next_state,
+                                   self.environment.game_state.snake.direction)
+            if self.training_steps % self.replay_every == 0 and len(self.replay_buffer) >= self.replay_batch:
+                self.replay()
+        self.step_schedules()
 
 
 class MCQAgent(QAgent):
 
-    def __init__(self, environment, **kwargs):
-        super().__init__(environment)
-        try:
-            with open("q_agent_table.pickle", "rb") as file:
-                self.q_table = pickle.load(file)
-        except(FileNotFoundError, FileExistsError):
-            self.q_table = {}
-        self.__trials_count = kwargs.get("trials", None)
+    def __init__(self, environment, trials=None, min_visits=10, tolerance=0.5, min_margin=0.0, sink=None,
+                 search_options=None, **kwargs):
+        """
+        :param environment: environment of the agent.
+        :param trials: number of searches in each state before following policy,
+        None to search in states that are not confident yet.
+        :param min_visits: updates of a state before its policy is trusted.
+        :param tolerance: average change of Q values of a state before its policy is trusted.
+        :param min_margin: lead of the best Q value before its policy is trusted.
+        :param sink: receives statistics of every search.
+        :param search_options: keyword arguments of the Monte Carlo search, e.g.
+        simulations and seed for a fixed, reproducible budget.
+        """
+        super().__init__(environment, **kwargs)
+        self.__trials_count = trials
         self.__trials = {}
-        self.__monte_carlo = mc.MonteCarloQLearning(mc.Board(self.environment.game_state), q_table=self.q_table,)
+        self.__policy_cache = PolicyCache(min_visits, tolerance, min_margin)
+        self.__sink = sink
+        self.__search_options = search_options or {}
+        self.__pool = None
+        self.__monte_carlo = None
+        self.__monte_carlo = self.__create_search()
 
     def get_next_action(self):
         self.state = self.environment.get_state()
         legal_actions = self.get_legal_actions()
+        q_values = self.q_table.get_values(self.state, legal_actions)
 
-        if self.state not in self.q_table:
-            self.q_table[self.state] = {ac: 0 for ac in legal_actions}
-
-        if self.__trials_count is None:  # always run simulation
-            self.__monte_carlo = mc.MonteCarloQLearning(mc.Board(self.environment.game_state))
+        if self.__trials_count is None:
+            # search only when Q values of the state are not reliable yet
+            action = self.__policy_cache.get_action(self.state, q_values)
+            if action is not None:
+                return action
+            self.__monte_carlo = self.__create_search()
             return self.__monte_carlo.get_action()
         else:
             if self.state not in self.__trials:
                 self.__trials[self.state] = self.__trials_count
             if self.__trials[self.state] > 0:
                 # run simulation until is explored enough
-                self.__monte_carlo = mc.MonteCarloQLearning(mc.Board(self.environment.game_state))
+                self.__monte_carlo = self.__create_search()
                 self.__trials[self.state] -= 1
                 return self.__monte_carlo.get_action()
             else:
                 # otherwise, follow policy
-                print("PRATI POLITIKU!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-                if not len(set(self.q_table[self.state].values())) == 1:
-                    maximum = max(self.q_table[self.state].items(), key=operator.itemgetter(1))[1]
-                    return random.choice([action for action, value in self.q_table[self.state].items()
+                if not len(set(q_values.values())) == 1:
+                    maximum = max(q_values.items(), key=operator.itemgetter(1))[1]
+                    return random.choice([action for action, value in q_values.items()
                                           if value == maximum])
+
+    def get_table_path(self):
+        if self.environment.encoder.size is None:
+            return "q_agent_table"
+        return "q_agent_table_features"
+
+    def __create_search(self):
+        if self.__monte_carlo is not None:
+            self.__monte_carlo.close()
+        workers = self.__search_options.get("workers", 1)
+        if workers > 1 and self.__pool is None:
+            # every decision has a new search, worker processes are started once
+            self.__pool = multiprocessing.Pool(workers - 1)
+        return mc.MonteCarloQLearning(mc.Board(self.environment.game_state), sink=self.__sink, pool=self.__pool,
+                                      **self.__search_options)
+
+    def close(self):
+        self.__monte_carlo.close()
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    def update(self):
+        state, action = self.state, self.current_action
+        old_q_value = self.q_table.get_value(state, action)
+        super().update()
+        self.__policy_cache.visit(state, self.q_table.get_value(state, action) - old_q_value)
+
+    @property
+    def policy_cache(self):
+        return self.__policy_cache
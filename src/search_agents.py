@@ -1,76 +1,37 @@
+from collections import deque
 from model import *
 import util
 
 ACTIONS = [DIRECTION.UP, DIRECTION.DOWN, DIRECTION.RIGHT, DIRECTION.LEFT]
 
 
-def update_snake_body(snake_body, direction, food_position):
+def get_state_successors(kernel, state):
     """
-    Move the snake to the desired direction by adding the food to that direction
-    and remove the tail if the snake does not eat food.
-    :param snake_body: snake body that needs to be updated
-    :param direction: snake's direction
-    :param food_position: current position of the food.
-    :return: updated snake body.
+    Generates states that can be reached with one action from given state
+    without dying. Every state is derived from its parent state by the step
+    kernel, so there is no need to replay the actions from the start state.
+    :param kernel: step kernel of the board.
+    :param state: compact state.
+    :return: list of (next_state, action, cost) triplets.
     """
-    head = snake_body[0][:]
-    new_snake_body = snake_body[:]
-    if direction == DIRECTION.RIGHT:
-        head[0] += 1
-    elif direction == DIRECTION.LEFT:
-        head[0] -= 1
-    elif direction == DIRECTION.UP:
-        head[1] -= 1
-    elif direction == DIRECTION.DOWN:
-        head[1] += 1
-
-    new_snake_body.insert(0, head)
-
-    if head != food_position:
-        new_snake_body.pop()
-    return new_snake_body
+    successors = []
+    for action in ACTIONS:
+        next_state, _, dead = kernel.step(state, action)
+        if not dead:
+            successors.append((next_state, action, 1))
+    return successors
 
 
 class EatFoodProblem(Problem):
 
-    def __generate_body(self, actions):
-        new_snake = self.snake.body[:]
-        for direction in actions:
-            head = new_snake[0][:]
-            if direction == DIRECTION.RIGHT:
-                head[0] += 1
-            elif direction == DIRECTION.LEFT:
-                head[0] -= 1
-            elif direction == DIRECTION.UP:
-                head[1] -= 1
-            elif direction == DIRECTION.DOWN:
-                head[1] += 1
-            else:
-                continue
-            new_snake.insert(0, head)
-            new_snake.pop()
-        return new_snake
-
-    def get_successors(self, actions):
-        successors = []
-        snake_body = self.__generate_body(actions)
-        for action in ACTIONS:
-            new_snake_body = update_snake_body(snake_body, action, self.food)
-            cost = 1
-            #  if hits a wall set cost to 999
-            if not (new_snake_body[0][0] >= self.game_state.width or new_snake_body[0][0] < 0)\
-                    and not (new_snake_body[0][1] >= self.game_state.height or new_snake_body[0][1] < 0):
-                collision = False
-                for body in new_snake_body[1:]:
-                    if new_snake_body[0] == body:
-                        collision = True
-                        break
-                if not collision:
-                    successors.append((new_snake_body[0], action, cost))
-        return successors
+    def get_successors(self, state):
+        return get_state_successors(self.kernel, state)
 
     def is_goal_state(self, state):
-        return state == self.food
+        """
+        :param state: cell index of the snake head.
+        """
+        return self.food is not None and state == self.kernel.index(self.food)
 
 
 class ReachPositionProblem(Problem):
@@ -107,44 +68,14 @@ class ReachPositionProblem(Problem):
                 counter += 1
                 side = 0
 
-    def __generate_body(self, actions):
-        new_snake = self.snake.body[:]
-        for direction in actions:
-            head = new_snake[0][:]
-            if direction == DIRECTION.RIGHT:
-                head[0] += 1
-            elif direction == DIRECTION.LEFT:
-                head[0] -= 1
-            elif direction == DIRECTION.UP:
-                head[1] -= 1
-            elif direction == DIRECTION.DOWN:
-                head[1] += 1
-            else:
-                continue
-            new_snake.insert(0, head)
-            new_snake.pop()
-        return new_snake
-
-    def get_successors(self, actions):
-        successors = []
-        snake_body = self.__generate_body(actions)
-        for action in ACTIONS:
-            new_snake_body = update_snake_body(snake_body, action, self.food)
-            cost = 1
-            #  if hits a wall set cost to 999
-            if not (new_snake_body[0][0] >= self.game_state.width or new_snake_body[0][0] < 0) \
-                    and not (new_snake_body[0][1] >= self.game_state.height or new_snake_body[0][1] < 0):
-                collision = False
-                for body in new_snake_body[1:]:
-                    if new_snake_body[0] == body:
-                        collision = True
-                        break
-                if not collision:
-                    successors.append((new_snake_body[0], action, cost))
-        return successors
+    def get_successors(self, state):
+        return get_state_successors(self.kernel, state)
 
     def is_goal_state(self, state):
-        return state == self.__target
+        """
+        :param state: cell index of the snake head.
+        """
+        return state == self.kernel.index(self.__target)
 
     def reset(self, game_state, target=None):
         super().reset(game_state)
@@ -156,16 +87,30 @@ class ReachPositionProblem(Problem):
         return self.__target
 
 
-def create_key(state):
-    key = ""
-    for point in state:
-        key += str(point[0]) + str(point[1])
-    return key
+def start_node(problem):
+    """
+    Creates search node for current snake position.
+    :param problem: problem that needs to be solved.
+    :return: node as [head, actions, cost, state], where head is cell index
+    of the snake head and state is compact state.
+    """
+    state = problem.get_start_state()
+    return [state[0][0], [DIRECTION.STOP], 0, state]
+
+
+def create_visited(problem):
+    """
+    Creates closed set as one byte per board cell, indexed by cell index
+    of the step kernel.
+    :param problem: problem that needs to be solved.
+    :return: empty closed set.
+    """
+    return bytearray(problem.game_state.width * problem.game_state.height)
 
 
 def a_star(problem, data_structure):
-    visited = {}
-    data_structure.push([problem.snake.body[0], [DIRECTION.STOP], 0])
+    visited = create_visited(problem)
+    data_structure.push(start_node(problem))
     while not data_structure.is_empty():
         path = data_structure.pop()
         current_state = path[0]
@@ -173,27 +118,21 @@ def a_star(problem, data_structure):
         if problem.is_goal_state(current_state):
             return path[1][1:]
 
-        try:
-            if visited[str(current_state[0]) + str(current_state[1])]:
-                visited[str(current_state[0]) + str(current_state[1])] = True
-        except KeyError:
-            visited[str(current_state[0]) + str(current_state[1])] = True
-            for successor in problem.get_successors(path[1]):
-                try:
-                    if visited[str(successor[0][0]) + str(successor[0][1])]:
-                        visited[str(successor[0][0]) + str(successor[0][1])] = True
-                except KeyError:
-                    successor_path = [path[1][:]]  # copy only action for optimisation purpose
-                    successor_path.insert(0, successor[0])   # add new snake position
-                    successor_path[1].append(successor[1])  # add new action
-                    successor_path.insert(2, path[2] + successor[2])   # add new action cost
-                    data_structure.push(successor_path)
+        if not visited[current_state]:
+            visited[current_state] = 1
+            problem.expanded_nodes += 1
+            for successor in problem.get_successors(path[3]):
+                head = successor[0][0][0]
+                if not visited[head]:
+                    # new head, actions, cost and state, one open node per cell
+                    data_structure.update([head, path[1] + [successor[1]],
+                                           path[2] + successor[2], successor[0]], key=head)
     return []
 
 
 def a_star_iterable(problem, data_structure, iterations=1):
-    visited = {}
-    data_structure.push([problem.snake.body[0], [DIRECTION.STOP], 0])
+    visited = create_visited(problem)
+    data_structure.push(start_node(problem))
     i = 0
     while not data_structure.is_empty():
         path = data_structure.pop()
@@ -202,25 +141,77 @@ def a_star_iterable(problem, data_structure, iterations=1):
         if problem.is_goal_state(current_state) or i == iterations:
             return path[1][1:]
 
-        try:
-            if visited[str(current_state[0]) + str(current_state[1])]:
-                visited[str(current_state[0]) + str(current_state[1])] = True
-        except KeyError:
-            visited[str(current_state[0]) + str(current_state[1])] = True
-            for successor in problem.get_successors(path[1]):
-                try:
-                    if visited[str(successor[0][0]) + str(successor[0][1])]:
-                        visited[str(successor[0][0]) + str(successor[0][1])] = True
-                except KeyError:
-                    successor_path = [path[1][:]]  # copy only action for optimisation purpose
-                    successor_path.insert(0, successor[0])  # add new snake position
-                    successor_path[1].append(successor[1])  # add new action
-                    successor_path.insert(2, path[2] + successor[2])  # add new action cost
-                    data_structure.push(successor_path)
+        if not visited[current_state]:
+            visited[current_state] = 1
+            problem.expanded_nodes += 1
+            for successor in problem.get_successors(path[3]):
+                head = successor[0][0][0]
+                if not visited[head]:
+                    # new head, actions, cost and state, one open node per cell
+                    data_structure.update([head, path[1] + [successor[1]],
+                                           path[2] + successor[2], successor[0]], key=head)
             i = i + 1
     return
 
 
+class PlanCache:
+    """
+    Keeps planned actions together with food position and snake heads
+    they were planned for. Plan stays valid while the snake follows it,
+    food does not move and next cell on the path is not blocked, so it
+    can be checked in constant time on every tick.
+    """
+    def __init__(self):
+        self.__actions = deque()
+        self.__heads = deque()
+        self.__origin = None
+        self.__food = None
+
+    def store(self, actions, snake_head, food):
+        """
+        Stores new plan.
+        :param actions: planned actions.
+        :param snake_head: snake head position when plan was made.
+        :param food: food position when plan was made.
+        """
+        self.__actions = deque(actions)
+        self.__heads = deque()
+        self.__origin = list(snake_head)
+        self.__food = None if food is None else list(food)
+        head = self.__origin
+        for action in self.__actions:
+            head = move_position(head, action)
+            self.__heads.append(head)
+
+    def is_valid(self, snake, food):
+        """
+        Checks if plan can be followed from current snake position.
+        :param snake: current snake.
+        :param food: current food position.
+        :return: is plan valid.
+        """
+        if len(self.__actions) == 0 or food != self.__food or snake.head != self.__origin:
+            return False
+        next_head = self.__heads[0]
+        # tail moves away, so the head can take its place
+        return not snake.is_occupied(next_head[0], next_head[1]) or next_head == snake.body[-1]
+
+    def pop(self):
+        """
+        Removes next action from the plan.
+        :return: next action.
+        """
+        self.__origin = self.__heads.popleft()
+        return self.__actions.popleft()
+
+    def clear(self):
+        self.__actions.clear()
+        self.__heads.clear()
+
+    def __len__(self):
+        return len(self.__actions)
+
+
 class SearchAgent(Agent):
     """
     Represents agent that manipulates with snake actions.
@@ -240,6 +231,15 @@ class SearchAgent(Agent):
     def problem(self):
         return self.__problem
 
+    @property
+    def expanded_nodes(self):
+        """
+        Number of nodes expanded by all searches of this agent.
+        """
+        if self.__problem is None:
+            return 0
+        return self.__problem.expanded_nodes
+
 
 class RandomSearchAgent(SearchAgent):
 
@@ -254,27 +254,45 @@ class ZigZagSearchAgent(SearchAgent):
 
     def __init__(self, problem=None):
         super().__init__(problem)
-        self.__data_structure = util.PriorityQueueWithFunction(
-            lambda path: path[2] + self.__heuristic(path[0]))
-        self.__actions = a_star_iterable(self.problem, self.__data_structure, 1)
+        self.__plan = PlanCache()
+        self.__plan_path()
 
     def update(self):
-        self.__data_structure.clear()
-        self.__actions = a_star_iterable(self.problem, self.__data_structure, 1)
+        if not self.__plan.is_valid(self.problem.snake, self.problem.food):
+            self.__plan_path()
 
     def get_next_action(self):
-        if self.__actions is None:
-            return random.choice(ACTIONS)
-        elif len(self.__actions) == 0:
-            self.__actions = a_star_iterable(self.problem, self.__data_structure, 1)
-            if self.__actions is None or len(self.__actions) == 0:
+        if not self.__plan.is_valid(self.problem.snake, self.problem.food):
+            self.__plan_path()
+            if len(self.__plan) == 0:
                 return random.choice(ACTIONS)
-        return self.__actions.pop(0)
+        return self.__plan.pop()
+
+    def __plan_path(self):
+        """
+        Plans the whole path to the food by taking the best successor one step
+        at a time, the same way as a_star_iterable does with single iteration.
+        Snake follows the same path when it replans on every tick, so plan is
+        computed only when food moves or path becomes blocked.
+        """
+        actions = []
+        state = start_node(self.problem)[3]
+        for _ in range(self.problem.game_state.width * self.problem.game_state.height):
+            if self.problem.is_goal_state(state[0][0]):
+                break
+            self.problem.expanded_nodes += 1
+            successors = self.problem.get_successors(state)
+            if len(successors) == 0:
+                break
+            # first successor wins a tie, like in priority queue
+            state, action, _ = min(successors, key=lambda successor: self.__heuristic(successor[0][0][0]))
+            actions.append(action)
+        self.__plan.store(actions, self.problem.snake.head, self.problem.food)
 
     def __heuristic(self, snake_head):
-        xy1 = snake_head
+        width = self.problem.game_state.width
         xy2 = self.problem.food
-        return ((xy1[0] - xy2[0]) ** 2 + (xy1[1] - xy2[1]) ** 2) ** 0.5
+        return ((snake_head % width - xy2[0]) ** 2 + (snake_head // width - xy2[1]) ** 2) ** 0.5
 
 
 class OroborusSearchAgent(SearchAgent):
@@ -286,9 +304,9 @@ class OroborusSearchAgent(SearchAgent):
         self.__actions = a_star(self.problem, self.__data_structure)
 
     def __heuristic(self, snake_head):
-        xy1 = snake_head
+        width = self.problem.game_state.width
         xy2 = self.problem.target
-        return ((xy1[0] - xy2[0]) ** 2 + (xy1[1] - xy2[1]) ** 2) ** 0.5
+        return ((snake_head % width - xy2[0]) ** 2 + (snake_head // width - xy2[1]) ** 2) ** 0.5
 
     def get_next_action(self):
         if len(self.__actions) == 0:
@@ -312,51 +330,48 @@ class SmartSearchAgent(SearchAgent):
         self.__data_structure = util.PriorityQueueWithFunction(
             lambda path: path[2] + self.__heuristic(path[0]))
         self.__remain_alive = False
-        self.__actions = a_star(self.problem, self.__data_structure)
+        self.__plan = PlanCache()
+        self.__plan.store(a_star(self.problem, self.__data_structure), self.problem.snake.head, self.problem.food)
 
     def update(self):
         self.__data_structure.clear()
 
     def get_next_action(self):
-        if len(self.__actions) == 0:
-            self.__actions = a_star(self.problem, self.__data_structure)
-            if len(self.__actions) == 0:
+        if not self.__plan.is_valid(self.problem.snake, self.problem.food):
+            self.__data_structure.clear()
+            actions = a_star(self.problem, self.__data_structure)
+            if len(actions) == 0:
                 try:
-                    self.__actions = [self.__stay_alive()[0]]
+                    actions = [self.__stay_alive()[0]]
                 except IndexError:
                     return random.choice(ACTIONS)
-        return self.__actions.pop(0)
+            self.__plan.store(actions, self.problem.snake.head, self.problem.food)
+        return self.__plan.pop()
 
     def __heuristic(self, snake_head):
-        xy1 = snake_head
+        width = self.problem.game_state.width
         xy2 = self.problem.food
-        return ((xy1[0] - xy2[0]) ** 2 + (xy1[1] - xy2[1]) ** 2) ** 0.5
+        return ((snake_head % width - xy2[0]) ** 2 + (snake_head // width - xy2[1]) ** 2) ** 0.5
 
     def __stay_alive(self):
         problem = self.problem
-        visited = {}
+        visited = create_visited(problem)
         data_structure = util.PriorityQueueWithFunction(lambda x: -len(x[1]))
         results = util.PriorityQueueWithFunction(lambda x: -len(x[1]))
-        data_structure.push([problem.snake.body[0], [DIRECTION.STOP], 0])
+        data_structure.push(start_node(problem))
 
         while not data_structure.is_empty():
             path = data_structure.pop()
             results.push(path)
             current_state = path[0]
 
-            try:
-                if visited[str(current_state[0]) + str(current_state[1])]:
-                    visited[str(current_state[0]) + str(current_state[1])] = True
-            except KeyError:
-                visited[str(current_state[0]) + str(current_state[1])] = True
-                for successor in problem.get_successors(path[1]):
-                    try:
-                        if visited[str(successor[0][0]) + str(successor[0][1])]:
-                            visited[str(successor[0][0]) + str(successor[0][1])] = True
-                    except KeyError:
-                        successor_path = [path[1][:]]  # copy only action for optimisation purpose
-                        successor_path.insert(0, successor[0])  # add new snake position
-                        successor_path[1].append(successor[1])  # add new action
-                        successor_path.insert(2, path[2] + successor[2])  # add new action cost
-                        data_structure.push(successor_path)
+            if not visited[current_state]:
+                visited[current_state] = 1
+                problem.expanded_nodes += 1
+                for successor in problem.get_successors(path[3]):
+                    head = successor[0][0][0]
+                    if not visited[head]:
+                        # new head, actions, cost and state
+                        data_structure.push([head, path[1] + [successor[1]],
+                                             path[2] + successor[2], successor[0]])
         return results.pop()[1][1:]
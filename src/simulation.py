@@ -0,0 +1,370 @@
+from search_agents import *
+from reinforcement_agents import *
+from general_agents import MCAgent
+
+
+class Simulation(ABC):
+    """
+    Represents game without display and frame limiter. It drives game state,
+    snake, food spawn and agent and contains the step logic that is shared
+    with the pygame games.
+    """
+    def __init__(self, board_size, agent=None, max_steps=None, agent_options=None):
+        """
+        Creates game state and agent.
+        :param board_size: size of a game board.
+        :param agent: name of the agent that plays the game.
+        :param max_steps: maximum number of steps, None for unlimited.
+        :param agent_options: keyword arguments of the agent.
+        """
+        self.__agent_options = agent_options or {}
+        self.__board_size = board_size
+        self.__game_state = GameState(board_size, board_size)
+        self.__score = 0
+        self.__steps = 0
+        self.__max_steps = max_steps
+        self.__running = True
+        self.__snake = self.__game_state.snake
+        self.__food_spawn = self.__game_state.food_spawn
+        self.__agent = self.get_agent(agent)
+
+    def get_agent(self, agent):
+        if agent is None:
+            return None
+        elif agent.upper() == "RANDOM":
+            return RandomSearchAgent()
+        elif agent.upper() == "ZIGZAG":
+            return ZigZagSearchAgent(EatFoodProblem(self.__game_state))
+        elif agent.upper() == "SMART":
+            return SmartSearchAgent(EatFoodProblem(self.__game_state))
+        elif agent.upper() == "OROBORUS":
+            return OroborusSearchAgent(ReachPositionProblem(self.__game_state))
+        elif agent.upper() == "MC":
+            return MCAgent(self.__game_state, **self.__agent_options)
+        return None
+
+    def draw_new_state(self, food_pos):
+        """
+        Nothing to draw without display.
+        :param food_pos: current food position.
+        """
+        pass
+
+    def game_over(self):
+        self.__running = False
+
+    def update(self):
+        """
+        Finish one step of the game.
+        """
+        self.__steps += 1
+        if self.__max_steps is not None and self.__steps >= self.__max_steps:
+            self.__running = False
+
+    def run(self):
+        """
+        Play the game until it is over.
+        :return: score and number of steps.
+        """
+        try:
+            self.start_game()
+        finally:
+            self.close()
+        return self.__score, self.__steps
+
+    def close(self):
+        """
+        Releases resources of the agent.
+        """
+        if self.__agent is not None:
+            self.__agent.close()
+
+    @abstractmethod
+    def start_game(self):
+        pass
+
+    @property
+    def board_size(self):
+        return self.__board_size
+
+    @property
+    def agent_options(self):
+        return self.__agent_options
+
+    @property
+    def running(self):
+        return self.__running
+
+    @property
+    def steps(self):
+        return self.__steps
+
+    @property
+    def score(self):
+        return self.__score
+
+    @score.setter
+    def score(self, value):
+        self.__score = value
+
+    @property
+    def food_spawn(self):
+        return self.__food_spawn
+
+    @food_spawn.setter
+    def food_spawn(self, value):
+        self.__food_spawn = value
+
+    @property
+    def snake(self):
+        return self.__snake
+
+    @snake.setter
+    def snake(self, value):
+        self.__snake = value
+
+    @property
+    def agent(self):
+        return self.__agent
+
+    @agent.setter
+    def agent(self, value):
+        self.__agent = value
+
+    @property
+    def game_state(self):
+        return self.__game_state
+
+    @game_state.setter
+    def game_state(self, value):
+        self.__game_state = value
+
+
+class SmartAgentsSimulation(Simulation):
+
+    def start_game(self):
+        while self.running:
+            self.snake.change_direction(self.agent.get_next_action())
+            food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
+
+            if self.snake.move(food_pos) == 1:
+                self.score += 1
+                self.food_spawn.set_food_on_board(False)
+                self.draw_new_state(food_pos)
+                if self.snake.check_collision():
+                    self.game_over()
+                    break
+                self.food_spawn.spawn_food(self.game_state.empty_cells())
+                if self.agent.problem is not None:
+                    self.agent.problem.reset(self.game_state)
+                self.agent.update()
+            else:
+                self.draw_new_state(food_pos)
+
+                if self.snake.check_collision():
+                    self.game_over()
+                    break
+                if self.agent.problem is not None:
+                    self.agent.problem.reset(self.game_state)
+                self.agent.update()
+
+            self.update()
+
+
+class OroborusAgentSimulation(Simulation):
+
+    def start_game(self):
+        while self.running:
+            if self.agent.action_count() == 0:
+                self.agent.problem.reset(self.game_state)
+                self.agent.update()
+            self.snake.change_direction(self.agent.get_next_action())
+            food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
+            if food_pos is None:
+                self.game_over()
+                break
+            if self.snake.move(food_pos) == 1:
+                self.score += 1
+                self.food_spawn.set_food_on_board(False)
+                self.draw_new_state(food_pos)
+                if self.snake.check_collision():
+                    self.game_over()
+                    break
+                self.food_spawn.spawn_food(self.game_state.empty_cells())
+            else:
+                self.draw_new_state(food_pos)
+                if self.snake.check_collision():
+                    self.game_over()
+                    break
+
+            self.update()
+
+
+class GeneralAgentSimulation(Simulation):
+
+    def start_game(self):
+        while self.running:
+            self.snake.change_direction(self.agent.get_next_action())
+            food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
+
+            if self.snake.move(food_pos) == 1:
+                self.score += 1
+                self.food_spawn.set_food_on_board(False)
+                self.draw_new_state(food_pos)
+                if self.snake.check_collision():
+                    self.game_over()
+                    break
+                self.food_spawn.spawn_food(self.game_state.empty_cells())
+            else:
+                self.draw_new_state(food_pos)
+                if self.snake.check_collision():
+                    self.game_over()
+                    break
+
+            self.update()
+
+
+class ReinforcementAgentsSimulation(Simulation):
+
+    def __init__(self, board_size, agent=None, episodes=100, max_steps=None, encoder=None, verbose=True,
+                 agent_options=None):
+        self.__encoder = encoder
+        super().__init__(board_size, agent, max_steps, agent_options)
+        self.agent = self.get_agent(agent)
+        self.__verbose = verbose
+        self.__episodes = episodes
+        self.__counter = 0
+        self.__scores = {}
+        self.__results = []
+        self.__episode_start = 0
+
+    def get_agent(self, agent):
+        if agent is None:
+            return None
+        elif agent.upper() == "Q":
+            return QAgent(Environment(self.game_state, self.__encoder), **self.agent_options)
+        elif agent.upper() == "MCQ":
+            return MCQAgent(Environment(self.game_state, self.__encoder), **self.agent_options)
+        return None
+
+    def start_game(self):
+        self.train()
+        save_q_table(self.agent.q_table, self.agent.table_path)
+        print(self.__scores)
+
+    def train(self):
+        """
+        Play episodes until number of episodes is reached.
+        """
+        while self.running:
+            if self.__counter == self.__episodes:
+                break
+            action = self.agent.get_next_action()
+            self.snake.change_direction(action)
+            self.agent.current_action = action
+            food_pos = self.food_spawn.food
+
+            if self.snake.move(food_pos) == 1:
+                self.agent.current_reward = self.agent.environment.get_reward()
+                self.agent.update()
+                self.score += 1
+                self.food_spawn.set_food_on_board(False)
+                food_pos = self.food_spawn.spawn_food(self.game_state.empty_cells())
+                self.draw_new_state(food_pos)
+                if self.snake.check_collision():
+                    self.__reset()
+                    self.draw_new_state(food_pos)
+            else:
+                self.agent.current_reward = self.agent.environment.get_reward()
+                self.agent.update()
+                self.draw_new_state(food_pos)
+
+                if self.snake.check_collision():
+                    self.__reset()
+                    self.draw_new_state(food_pos)
+
+            self.update()
+
+    def __reset(self):
+        self.game_state = GameState(self.game_state.height, self.game_state.width)
+        if self.__verbose:
+            print("Score:", self.score)
+        if self.score in self.__scores.keys():
+            self.__scores[self.score] += 1
+        else:
+            self.__scores[self.score] = 1
+        self.__results.append((self.score, self.steps + 1 - self.__episode_start))
+        self.__episode_start = self.steps + 1
+        self.score = 0
+        self.snake = self.game_state.snake
+        self.food_spawn = self.game_state.food_spawn
+        self.agent.environment = Environment(self.game_state, self.__encoder)
+        self.agent.reset()
+        self.__counter += 1
+        if self.__verbose:
+            print("Episode :", self.__counter)
+
+    @property
+    def episodes(self):
+        return self.__episodes
+
+    @episodes.setter
+    def episodes(self, value):
+        self.__episodes = value
+
+    @property
+    def episode(self):
+        return self.__counter
+
+    @property
+    def scores(self):
+        return self.__scores
+
+    @property
+    def results(self):
+        return self.__results
+
+
+def get_simulation(board_size, agent, max_steps=None, episodes=100, encoder=None, agent_options=None):
+    """
+    Creates headless game for given agent.
+    :param board_size: size of a game board.
+    :param agent: name of the agent.
+    :param max_steps: maximum number of steps per game, None for unlimited.
+    :param episodes: number of episodes for reinforcement agents.
+    :param encoder: state encoder for reinforcement agents.
+    :param agent_options: keyword arguments of the agent.
+    :return: headless game.
+    """
+    if agent.upper() in ("ZIGZAG", "SMART", "RANDOM"):
+        return SmartAgentsSimulation(board_size, agent, max_steps, agent_options)
+    elif agent.upper() == "OROBORUS":
+        return OroborusAgentSimulation(board_size, agent, max_steps, agent_options)
+    elif agent.upper() == "MC":
+        return GeneralAgentSimulation(board_size, agent, max_steps, agent_options)
+    elif agent.upper() in ("Q", "MCQ"):
+        return ReinforcementAgentsSimulation(board_size, agent, episodes, max_steps, encoder,
+                                             agent_options=agent_options)
+    raise ValueError("Unknown agent: {0}".format(agent))
+
+
+def run_games(board_size, agent, games=1, max_steps=None, encoder=None, agent_options=None):
+    """
+    Plays given number of headless games and reports results.
+    :param board_size: size of a game board.
+    :param agent: name of the agent.
+    :param games: number of games to play.
+    :param max_steps: maximum number of steps per game, None for unlimited.
+    :param encoder: state encoder for reinforcement agents.
+    :param agent_options: keyword arguments of the agent.
+    :return: list of (score, steps) pairs, one for each game.
+    """
+    if agent.upper() in ("Q", "MCQ"):
+        # every game is one training episode of the same agent
+        simulation = get_simulation(board_size, agent, max_steps, games, encoder, agent_options)
+        simulation.run()
+        return simulation.results
+    results = []
+    for _ in range(games):
+        results.append(get_simulation(board_size, agent, max_steps, agent_options=agent_options).run())
+    return results
@@ -1,31 +1,66 @@
 import getopt
-from game import *
+import sys
+import time
 
 SIZES = {"XXS": 5, "XS": 8, "S": 16, "M": 26, "L": 30}
 AGENTS = ["RANDOM", "ZIGZAG", "SMART", "OROBORUS", "Q", "MC", "MCQ"]
+RENDERERS = ["FULL", "DIRTY", "SURFARRAY"]
 
 
 def parse_args(argv):
     """
     Parse program arguments.
     :param argv: list of strings that represent program arguments.
-    :return: chosen algorithm, game board size and agent.
+    :return: chosen agent, game board size, headless mode, number of headless games,
+    feature state encoding, file for search statistics, number of search processes,
+    renderer and profiling options.
     """
+    usage = "snake.py -a <agent> -s <size> [--headless] [-g <games>] [--features] [--stats=<file>] " \
+            "[-w <workers>] [--renderer=<full|dirty|surfarray>] [--timing] [--trace=<file>] " \
+            "[--profile=<cprofile|tracemalloc>]"
     try:
-        opts, args = getopt.getopt(argv, "ha:s:", ["help", "agent=", "size="])
+        opts, args = getopt.getopt(argv, "ha:s:g:w:", ["help", "agent=", "size=", "headless", "games=", "features",
+                                                       "stats=", "workers=", "renderer=", "timing", "trace=",
+                                                       "profile="])
     except getopt.GetoptError:
         print("Wrong arguments")
-        print("snake.py -a <agent> -s <size>")
+        print(usage)
         sys.exit(2)
 
+    profiling = {"timing": False, "trace": None, "profiler": None}
     if len(opts) == 0:
-        return "MANUAL", SIZES["LARGE"]
+        return "MANUAL", SIZES["LARGE"], False, 1, False, None, 1, "DIRTY", profiling
 
-    snake_agent, board_size = "", 0
+    snake_agent, board_size, headless, games, features, stats, renderer = "", 0, False, 1, False, None, "DIRTY"
+    workers = 1
     for opt, arg in opts:
         if opt == "-h":
-            print("snake.py -a <agent> -s <size>")
+            print(usage)
             sys.exit()
+        elif opt == "--headless":
+            headless = True
+        elif opt == "--stats":
+            stats = arg
+        elif opt == "--features":
+            features = True
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt == "--renderer":
+            renderer = arg.upper()
+            if renderer not in RENDERERS:
+                print("Allowed values for --renderer argument are: " + " ".join(RENDERERS).lower())
+                sys.exit(2)
+        elif opt == "--timing":
+            profiling["timing"] = True
+        elif opt == "--trace":
+            profiling["trace"] = arg
+        elif opt == "--profile":
+            if arg.lower() not in ("cprofile", "tracemalloc"):
+                print("Allowed values for --profile argument are: cprofile tracemalloc")
+                sys.exit(2)
+            profiling["profiler"] = arg.lower()
+        elif opt in ("-g", "--games"):
+            games = int(arg)
         elif opt in ("-a", "agent"):
             snake_agent = arg
             if snake_agent.upper() not in AGENTS:
@@ -44,36 +79,123 @@ def parse_args(argv):
                 print(message)
                 sys.exit(2)
             else:
-                if snake_agent.upper() == "Q":
-                    if board_size.upper() == "M" or board_size.upper() == "L":
-                        board_size = SIZES["XS"]
-                    elif board_size.upper() == "S":
-                        board_size = SIZES["XXS"]
-                    else:
-                        board_size = SIZES[board_size.upper()]
-                elif snake_agent.upper() == "OROBORUS" and board_size.upper() == "XXS":
-                    board_size = SIZES["XS"]
-                else:
-                    board_size = SIZES[board_size.upper()]
-    return snake_agent, board_size
+                board_size = get_board_size(snake_agent, board_size, features)
+    if headless and (profiling["timing"] or profiling["trace"]):
+        print("Phases of the game loop are timed only in games with display, use --profile in headless mode")
+        sys.exit(2)
+    return snake_agent, board_size, headless, games, features, stats, workers, renderer, profiling
+
+
+def get_board_size(agent, size, features=False):
+    """
+    Board size that agent plays on. Q agent without features plays on smaller
+    boards because the number of states grows with the board.
+    :param agent: name of the agent.
+    :param size: name of the size.
+    :param features: whether reinforcement agent uses feature state encoding.
+    :return: game board size.
+    """
+    if agent.upper() == "Q" and not features:
+        if size.upper() == "M" or size.upper() == "L":
+            return SIZES["XS"]
+        elif size.upper() == "S":
+            return SIZES["XXS"]
+    elif agent.upper() == "OROBORUS" and size.upper() == "XXS":
+        return SIZES["XS"]
+    return SIZES[size.upper()]
+
+
+def get_agent_options(agent, workers=1):
+    """
+    :param agent: name of the agent.
+    :param workers: number of processes of Monte Carlo searches.
+    :return: keyword arguments of the agent.
+    """
+    if workers > 1 and agent.upper() == "MC":
+        return {"workers": workers}
+    elif workers > 1 and agent.upper() == "MCQ":
+        return {"search_options": {"workers": workers}}
+    return {}
+
+
+def run_headless(agent, size, games, encoder=None, stats=None, workers=1):
+    """
+    Plays games without display and reports scores and step counts.
+    :param agent: name of the agent.
+    :param size: game board size.
+    :param games: number of games to play.
+    :param encoder: state encoder for reinforcement agents.
+    :param stats: file for aggregated statistics of Monte Carlo searches.
+    :param workers: number of processes of Monte Carlo searches.
+    """
+    from simulation import run_games
+    from monte_carlo_tree_search import AggregateFileSink
+    agent_options = get_agent_options(agent, workers)
+    if stats is not None and agent.upper() in ("MC", "MCQ"):
+        agent_options["sink"] = AggregateFileSink(stats)
+    begin = time.perf_counter()
+    results = run_games(size, agent, games, encoder=encoder, agent_options=agent_options)
+    duration = time.perf_counter() - begin
+    if "sink" in agent_options:
+        agent_options["sink"].close()
+    for i, (score, steps) in enumerate(results):
+        print("Game {0}: score {1}, steps {2}".format(i + 1, score, steps))
+    total_steps = sum(steps for _, steps in results)
+    print("Games: {0}, Steps: {1}, Duration: {2:.3f}s, Steps per second: {3:.0f}"
+          .format(len(results), total_steps, duration, total_steps / duration if duration > 0 else 0))
+
+
+def run_game(game, timing=False, trace=None, profiler=None):
+    """
+    Plays the game, optionally with timing of game loop phases and profiler.
+    Summary of phases and the trace are written also when the game exits
+    the program.
+    :param game: game with display.
+    :param timing: whether to time phases and print their summary.
+    :param trace: file for Chrome trace of the phases.
+    :param profiler: None, "cprofile" or "tracemalloc".
+    """
+    from instrumentation import PhaseTimer, run_profiled
+    timer = None
+    if timing or trace is not None:
+        timer = PhaseTimer(trace is not None)
+        timer.install(game)
+    try:
+        run_profiled(game.start_game, profiler)
+    finally:
+        game.close()
+        if timer is not None:
+            timer.uninstall()
+            timer.print_summary()
+            if trace is not None:
+                timer.write_trace(trace)
+                print("Trace written to " + trace)
 
 
 if __name__ == '__main__':
-    agent, size = parse_args(sys.argv[1:])
+    agent, size, headless, games, features, stats, workers, renderer, profiling = parse_args(sys.argv[1:])
+    from model import FeatureStateEncoder
+    encoder = FeatureStateEncoder() if features else None
+    if headless:
+        from instrumentation import run_profiled
+        run_profiled(lambda: run_headless(agent, size, games, encoder, stats, workers), profiling["profiler"])
+        sys.exit()
+    from game import *
     if size == SIZES["XXS"] or size == SIZES["XS"]:
         block_size = 50
     else:
         block_size = 20
     if agent == "MANUAL":
-        game = ManualGame(size)
+        game = ManualGame(size, renderer=renderer)
     elif agent.upper() == "ZIGZAG" or agent.upper() == "SMART" or agent.upper() == "RANDOM":
-        game = SmartAgentsGame(size, agent, 10, block_size)
+        game = SmartAgentsGame(size, agent, 10, block_size, renderer)
     elif agent.upper() == "OROBORUS":
-        game = OroborusAgentGame(size, agent, 30, block_size)
+        game = OroborusAgentGame(size, agent, 30, block_size, renderer)
     elif agent.upper() == "MC":
-        game = GeneralAgentGame(size, agent, 10, block_size)
+        game = GeneralAgentGame(size, agent, 10, block_size, renderer, get_agent_options(agent, workers))
     elif agent.upper() == "Q" or agent.upper() == "MCQ":
-        game = ReinforcementAgentsGame(size, agent, 10, block_size, 30)
+        game = ReinforcementAgentsGame(size, agent, 10, block_size, 30, encoder, renderer,
+                                       get_agent_options(agent, workers))
     else:
-        game = ManualGame(size)
-    game.start_game()
+        game = ManualGame(size, renderer=renderer)
+    run_game(game, **profiling)
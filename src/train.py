@@ -0,0 +1,260 @@
+import getopt
+import multiprocessing
+import os
+import random
+import sys
+import time
+from model import FeatureStateEncoder
+from reinforcement_agents import LinearSchedule, Schedule, save_q_table
+from simulation import ReinforcementAgentsSimulation
+from snake import SIZES, get_board_size
+
+
+class RecordingQTable:
+    """
+    Wraps Q-table of a worker and remembers Q values changed by the agent
+    since the last synchronization.
+    """
+    def __init__(self, q_table):
+        """
+        :param q_table: wrapped Q-table.
+        """
+        self.__q_table = q_table
+        self.__updates = {}
+
+    def get_values(self, state, actions):
+        return self.__q_table.get_values(state, actions)
+
+    def get_value(self, state, action):
+        return self.__q_table.get_value(state, action)
+
+    def set_value(self, state, action, value):
+        self.__q_table.set_value(state, action, value)
+        self.__updates[state, action] = value
+
+    def apply(self, values):
+        """
+        Sets values received from the trainer without recording them.
+        :param values: dictionary of (state, action) and Q value.
+        """
+        for (state, action), value in values.items():
+            self.__q_table.set_value(state, action, value)
+
+    def pop_updates(self):
+        """
+        :return: values changed since the last call.
+        """
+        updates, self.__updates = self.__updates, {}
+        return updates
+
+
+class SharedSchedule(Schedule):
+    """
+    Schedule of a worker that follows the training steps of all workers
+    together, so schedules end after the requested number of steps however
+    many workers train. Between synchronizations other workers are assumed
+    to make as many steps as this one.
+    """
+    def __init__(self, schedule, workers):
+        """
+        :param schedule: schedule over training steps of all workers.
+        :param workers: number of workers.
+        """
+        self.__schedule = schedule
+        self.__workers = workers
+        self.__steps = 0
+        self.__local_steps = 0
+
+    def synchronize(self, steps, local_steps):
+        """
+        :param steps: training steps of all workers at the synchronization.
+        :param local_steps: training steps of this worker at the synchronization.
+        """
+        self.__steps = steps
+        self.__local_steps = local_steps
+
+    def value(self, step):
+        return self.__schedule.value(self.__steps + self.__workers * (step - self.__local_steps))
+
+
+def train_worker(connection, board_size, agent, encoder, seed, agent_options, workers=1):
+    """
+    Worker process that plays episodes with its own copy of the Q-table.
+    It receives merged values, number of episodes and training steps of all
+    workers, plays the episodes and sends back changed values and results,
+    until it receives None.
+    :param connection: pipe connection to the trainer.
+    :param board_size: size of a game board.
+    :param agent: name of the agent.
+    :param encoder: state encoder.
+    :param seed: random seed of the worker.
+    :param agent_options: keyword arguments of the agent.
+    :param workers: number of workers that share the schedules.
+    """
+    random.seed(seed)
+    simulation = ReinforcementAgentsSimulation(board_size, agent, 0, encoder=encoder, verbose=False,
+                                               agent_options=agent_options)
+    q_table = RecordingQTable(simulation.agent.q_table)
+    simulation.agent.q_table = q_table
+    schedules = [SharedSchedule(simulation.agent.alpha_schedule, workers),
+                 SharedSchedule(simulation.agent.epsilon_schedule, workers)]
+    simulation.agent.alpha_schedule, simulation.agent.epsilon_schedule = schedules
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        values, episodes, steps = message
+        q_table.apply(values)
+        for schedule in schedules:
+            schedule.synchronize(steps, simulation.agent.training_steps)
+        start = len(simulation.results)
+        simulation.episodes = simulation.episode + episodes
+        simulation.train()
+        connection.send((q_table.pop_updates(), simulation.results[start:]))
+    simulation.close()
+    connection.close()
+
+
+def merge(q_table, updates):
+    """
+    Averages values changed by workers and stores them to the Q-table.
+    :param q_table: Q-table of the trainer.
+    :param updates: list of dictionaries of (state, action) and Q value.
+    :return: dictionary of merged values.
+    """
+    totals = {}
+    for worker_updates in updates:
+        for key, value in worker_updates.items():
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [value, 1]
+            else:
+                total[0] += value
+                total[1] += 1
+    merged = {}
+    for (state, action), (total, count) in totals.items():
+        merged[state, action] = total / count
+        q_table.set_value(state, action, total / count)
+    return merged
+
+
+def train(board_size, agent, episodes, workers=None, sync=50, encoder=None, seed=None, agent_options=None):
+    """
+    Trains reinforcement agent without display in parallel worker processes.
+    Trainer keeps the shared Q-table. Every round each worker plays up to sync
+    episodes, changed values are averaged and sent to all workers with the next
+    round. Trained table is saved to the file the agent loads.
+    :param board_size: size of a game board.
+    :param agent: name of the agent, Q or MCQ.
+    :param episodes: total number of episodes.
+    :param workers: number of worker processes, number of CPUs by default.
+    :param sync: number of episodes each worker plays between synchronizations.
+    :param encoder: state encoder.
+    :param seed: random seed, workers use consecutive seeds.
+    :param agent_options: keyword arguments of the agent, such as schedules and replay.
+    :return: list of (score, steps) pairs, one for each episode.
+    """
+    workers = workers or os.cpu_count() or 1
+    simulation = ReinforcementAgentsSimulation(board_size, agent, 0, encoder=encoder, verbose=False,
+                                               agent_options=agent_options)
+    q_table = simulation.agent.q_table
+    connections, processes = [], []
+    for i in range(workers):
+        parent, child = multiprocessing.Pipe()
+        worker_seed = None if seed is None else seed + i
+        process = multiprocessing.Process(target=train_worker,
+                                          args=(child, board_size, agent, encoder, worker_seed, agent_options,
+                                                workers),
+                                          daemon=True)
+        process.start()
+        child.close()
+        connections.append(parent)
+        processes.append(process)
+
+    results, merged, steps = [], {}, 0
+    begin = time.perf_counter()
+    try:
+        while len(results) < episodes:
+            count = min(workers * sync, episodes - len(results))
+            for i, connection in enumerate(connections):
+                connection.send((merged, count // workers + (1 if i < count % workers else 0), steps))
+            updates = []
+            for connection in connections:
+                worker_updates, worker_results = connection.recv()
+                updates.append(worker_updates)
+                results.extend(worker_results)
+                steps += sum(episode_steps for _, episode_steps in worker_results)
+            merged = merge(q_table, updates)
+            duration = time.perf_counter() - begin
+            print("Episodes: {0}/{1}, Mean score: {2:.2f}, Episodes per second: {3:.0f}"
+                  .format(len(results), episodes, sum(score for score, _ in results[-count:]) / count,
+                          len(results) / duration))
+    finally:
+        for connection in connections:
+            connection.send(None)
+        for process in processes:
+            process.join()
+        simulation.close()
+
+    duration = time.perf_counter() - begin
+    save_q_table(q_table, simulation.agent.table_path)
+    total_steps = sum(steps for _, steps in results)
+    print("Episodes: {0}, Steps: {1}, Duration: {2:.3f}s, Episodes per second: {3:.0f}, Steps per second: {4:.0f}"
+          .format(len(results), total_steps, duration, len(results) / duration, total_steps / duration))
+    return results
+
+
+def parse_args(argv):
+    """
+    Parse program arguments.
+    :param argv: list of strings that represent program arguments.
+    :return: agent, game board size, number of episodes, number of workers,
+    episodes between synchronizations, feature state encoding and agent options.
+    """
+    usage = "train.py -a <q|mcq> -s <size> -e <episodes> [-w <workers>] [--sync=<episodes>] [--features] " \
+            "[--anneal=<steps>] [--replay=<size>]"
+    try:
+        opts, args = getopt.getopt(argv, "ha:s:e:w:", ["help", "agent=", "size=", "episodes=", "workers=",
+                                                       "sync=", "features", "anneal=", "replay="])
+    except getopt.GetoptError:
+        print("Wrong arguments")
+        print(usage)
+        sys.exit(2)
+
+    agent, size, episodes, workers, sync, features = "Q", "XS", 1000, None, 50, False
+    agent_options = {}
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-a", "--agent"):
+            agent = arg
+            if agent.upper() not in ("Q", "MCQ"):
+                print("Allowed values for -a (agent) argument are: Q MCQ")
+                sys.exit(2)
+        elif opt in ("-s", "--size"):
+            size = arg
+            if size.upper() not in SIZES.keys():
+                print("Allowed values for -s (size) argument are: " + " ".join(SIZES))
+                sys.exit(2)
+        elif opt in ("-e", "--episodes"):
+            episodes = int(arg)
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt == "--sync":
+            sync = int(arg)
+        elif opt == "--features":
+            features = True
+        elif opt == "--anneal":
+            # explore a lot and learn fast at the beginning
+            agent_options["epsilon"] = LinearSchedule(1.0, 0.01, int(arg))
+            agent_options["alpha"] = LinearSchedule(0.5, 0.1, int(arg))
+        elif opt == "--replay":
+            agent_options["replay_size"] = int(arg)
+    return agent, get_board_size(agent, size, features), episodes, workers, sync, features, agent_options
+
+
+if __name__ == '__main__':
+    agent, size, episodes, workers, sync, features, agent_options = parse_args(sys.argv[1:])
+    train(size, agent, episodes, workers, sync, FeatureStateEncoder() if features else None,
+          agent_options=agent_options)
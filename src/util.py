@@ -1,4 +1,4 @@
-import heapq
+import itertools
 import random
 
 
@@ -8,29 +8,46 @@ class PriorityQueue:
       has a priority associated with it and the client is usually interested
       in quick retrieval of the lowest-priority item in the queue. This
       data structure allows O(1) access to the lowest-priority item.
+      Items with equal priority are returned in insertion order. Items pushed
+      with a key are indexed by that key, so their priority can be decreased
+      in O(log n) without duplicate entries.
     """
     def __init__(self):
         self.__heap = []
+        self.__index = {}
+        self.__counter = itertools.count()
 
     def __len__(self):
         return len(self.__heap)
 
-    def push(self, item, priority):
+    def push(self, item, priority, key=None):
         """
         Add item to priority queue
         :param item: item that needs to be added
         :param priority: item's priority
+        :param key: hashable key of the item, used by update
         """
-        entry = (priority, item)
-        heapq.heappush(self.__heap, entry)
+        entry = [priority, next(self.__counter), item, key]
+        self.__heap.append(entry)
+        if key is not None:
+            self.__index[key] = len(self.__heap) - 1
+        self.__sift_up(len(self.__heap) - 1)
 
     def pop(self):
         """
         Remove item from priority queue with lowest priority
         :return: item with lowest priority
         """
-        (_, item) = heapq.heappop(self.__heap)
-        return item
+        last = self.__heap.pop()
+        if self.__heap:
+            entry = self.__heap[0]
+            self.__place(last, 0)
+            self.__sift_down(0)
+        else:
+            entry = last
+        if entry[3] is not None:
+            del self.__index[entry[3]]
+        return entry[2]
 
     def is_empty(self):
         """
@@ -39,28 +56,77 @@ class PriorityQueue:
         """
         return len(self.__heap) == 0
 
-    def update(self, item, priority):
+    def update(self, item, priority, key=None):
         """
         If item already in priority queue with higher priority, update its priority
-        and rebuild the __heap.
+        and move it up the __heap.
         If item already in priority queue with equal or lower priority, do nothing.
         If item not in priority queue, do the same thing as self.push.
         :param item: item that needs to be updated
         :param priority: item's priority
+        :param key: hashable key of the item, item itself if None. Unhashable
+        items without key are found by comparing them with every item in O(n).
         """
-        for index, (p, c, i) in enumerate(self.__heap):
-            if i == item:
-                if p <= priority:
-                    break
-                del self.__heap[index]
-                self.__heap.append((priority, c, item))
-                heapq.heapify(self.__heap)
-                break
-        else:
-            self.push(item, priority)
+        if key is None:
+            try:
+                hash(item)
+                key = item
+            except TypeError:
+                position = next((i for i, entry in enumerate(self.__heap)
+                                 if entry[3] is None and entry[2] == item), None)
+                if position is None:
+                    self.push(item, priority)
+                elif priority < self.__heap[position][0]:
+                    self.__heap[position][0] = priority
+                    self.__sift_up(position)
+                return
+        position = self.__index.get(key)
+        if position is None:
+            self.push(item, priority, key)
+        elif priority < self.__heap[position][0]:
+            entry = self.__heap[position]
+            entry[0] = priority
+            entry[2] = item
+            self.__sift_up(position)
 
     def clear(self):
         self.__heap = []
+        self.__index = {}
+
+    def __place(self, entry, position):
+        self.__heap[position] = entry
+        if entry[3] is not None:
+            self.__index[entry[3]] = position
+
+    def __sift_up(self, position):
+        heap = self.__heap
+        entry = heap[position]
+        while position > 0:
+            parent = (position - 1) >> 1
+            if heap[parent][0] < entry[0] or \
+                    (heap[parent][0] == entry[0] and heap[parent][1] < entry[1]):
+                break
+            self.__place(heap[parent], position)
+            position = parent
+        self.__place(entry, position)
+
+    def __sift_down(self, position):
+        heap = self.__heap
+        size = len(heap)
+        entry = heap[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            right = child + 1
+            if right < size and (heap[right][0] < heap[child][0] or
+                                 (heap[right][0] == heap[child][0] and heap[right][1] < heap[child][1])):
+                child = right
+            if entry[0] < heap[child][0] or (entry[0] == heap[child][0] and entry[1] < heap[child][1]):
+                break
+            self.__place(heap[child], position)
+            position = child
+        self.__place(entry, position)
 
 
 class PriorityQueueWithFunction(PriorityQueue):
@@ -78,13 +144,24 @@ class PriorityQueueWithFunction(PriorityQueue):
         self.priorityFunction = priority_function      # store the priority function
         PriorityQueue.__init__(self)        # super-class initializer
 
-    def push(self, item, priority=None):
+    def push(self, item, priority=None, key=None):
         """
         Adds an item to the queue with priority from the priority function
         :param item: item that needs to be added to priority queue
         :param priority: it should be always None
+        :param key: hashable key of the item, used by update
+        """
+        PriorityQueue.push(self, item, self.priorityFunction(item), key)
+
+    def update(self, item, priority=None, key=None):
+        """
+        Updates an item in the queue with priority from the priority function
+        :param item: item that needs to be updated
+        :param priority: it should be always None
+        :param key: hashable key of the item, item itself if None
+        (compared with every item if it is unhashable)
         """
-        PriorityQueue.push(self, item, self.priorityFunction(item))
+        PriorityQueue.update(self, item, self.priorityFunction(item), key)
 
 
 def flip_coin(p):
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules of the game are imported from src like snake.py imports them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
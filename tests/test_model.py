@@ -0,0 +1,63 @@
+import random
+import pytest
+import monte_carlo_tree_search as mc
+from model import CellState, DIRECTION, GameState, LEGAL_ACTIONS, get_compact_state
+
+
+def test_snake_move_follows_step_kernel():
+    rng = random.Random(3)
+    for _ in range(50):
+        game_state = GameState(8, 8)
+        snake, kernel = game_state.snake, game_state.kernel
+        food = list(game_state.food_spawn.spawn_food(game_state.empty_cells()))
+        for _ in range(200):
+            snake.direction = rng.choice(LEGAL_ACTIONS[snake.direction])
+            state, ate, dead = kernel.step(get_compact_state(game_state, food), snake.direction)
+            assert snake.move(food) == ate
+            assert snake.check_collision() == dead
+            if dead:
+                break
+            assert get_compact_state(game_state, food)[0] == state[0]
+            # free cells are the cells that the snake does not occupy
+            free = set(game_state.empty_cells())
+            assert free == {(x, y) for x in range(8) for y in range(8) if not snake.is_occupied(x, y)}
+            assert all(cell in game_state.empty_cells() for cell in free)
+            if ate:
+                game_state.food_spawn.set_food_on_board(False)
+                food = game_state.food_spawn.spawn_food(game_state.empty_cells())
+                if food is None:
+                    break
+                assert tuple(food) in free
+
+
+def test_step_kernel_rejects_stop():
+    game_state = GameState(8, 8)
+    state = get_compact_state(game_state)
+    with pytest.raises(ValueError):
+        game_state.kernel.step(state, DIRECTION.STOP)
+    with pytest.raises(ValueError):
+        game_state.kernel.advance(state[0][0], state[0][-1], state[1], bytearray(64), DIRECTION.STOP)
+
+
+def test_grid_uses_cell_indices_of_kernel():
+    game_state = GameState(8, 8)
+    for x, y in game_state.snake.body:
+        assert game_state.grid.cells[game_state.kernel.index((x, y))] == CellState.SNAKE_BODY
+        assert game_state.grid[x][y] == CellState.SNAKE_BODY
+
+
+def test_rollout_follows_step_kernel():
+    for seed in range(300):
+        random.seed(seed)
+        board = mc.Board(GameState(8, 8))
+        moves = random.randrange(1, 60)
+        random_state = random.getstate()
+        status = board.rollout(board.start_state, moves)
+        random.setstate(random_state)
+        state, expected = board.start_state, mc.GameStatus.IN_PROGRESS
+        for _ in range(moves):
+            state = random.choice([board.next_state(state, action) for action in board.get_legal_actions(state)])
+            expected = board.check_game_status(state)
+            if expected != mc.GameStatus.IN_PROGRESS:
+                break
+        assert status == expected
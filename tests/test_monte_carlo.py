@@ -0,0 +1,11 @@
+import monte_carlo_tree_search as mc
+from model import GameState, LEGAL_ACTIONS
+
+
+def test_q_learning_search_with_small_budget():
+    # two simulations cannot expand every successor of the root
+    for seed in range(20):
+        game_state = GameState(10, 10)
+        search = mc.MonteCarloQLearning(mc.Board(game_state), simulations=2, max_moves=20, seed=seed)
+        action = search.get_action()
+        assert action in LEGAL_ACTIONS[game_state.snake.direction]
@@ -0,0 +1,78 @@
+import numpy as np
+from model import DIRECTION
+from reinforcement_agents import DenseQTable, InternedQTable, QTable
+
+ACTIONS = [DIRECTION.UP, DIRECTION.LEFT, DIRECTION.RIGHT]
+
+
+def create_table(states):
+    table = InternedQTable(capacity=4)
+    for state in range(states):
+        for action in ACTIONS:
+            table.set_value(("state", state), action, state + action / 10)
+    return table
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "table")
+    create_table(100).save(path)
+    table = InternedQTable()
+    table.load(path)
+    assert len(table) == 100
+    assert np.isclose(table.get_value(("state", 42), DIRECTION.LEFT), 42 + DIRECTION.LEFT / 10)
+
+
+def test_save_to_loaded_path(tmp_path):
+    path = str(tmp_path / "table")
+    create_table(100000).save(path)
+    table = InternedQTable()
+    table.load(path)
+    table.set_value(("state", 7), DIRECTION.UP, -1.5)
+    table.set_value(("new",), DIRECTION.RIGHT, 2.5)
+    table.save(path)
+
+    loaded = InternedQTable()
+    loaded.load(path)
+    assert len(loaded) == 100001
+    assert loaded.get_value(("state", 7), DIRECTION.UP) == -1.5
+    assert loaded.get_value(("new",), DIRECTION.RIGHT) == 2.5
+    assert np.isclose(loaded.get_value(("state", 99999), DIRECTION.LEFT), 99999 + DIRECTION.LEFT / 10)
+    assert not (tmp_path / "table.npy.tmp").exists()
+
+
+def test_save_changed_value_to_loaded_path(tmp_path):
+    # values stay memory mapped when no state is added
+    path = str(tmp_path / "table")
+    create_table(100000).save(path)
+    table = InternedQTable()
+    table.load(path)
+    table.set_value(("state", 7), DIRECTION.UP, -1.5)
+    table.save(path)
+
+    loaded = InternedQTable()
+    loaded.load(path)
+    assert len(loaded) == 100000
+    assert loaded.get_value(("state", 7), DIRECTION.UP) == -1.5
+    assert np.isclose(loaded.get_value(("state", 99999), DIRECTION.LEFT), 99999 + DIRECTION.LEFT / 10)
+
+
+def test_loaded_table_is_not_changed_until_saved(tmp_path):
+    path = str(tmp_path / "table")
+    create_table(10).save(path)
+    table = InternedQTable()
+    table.load(path)
+    table.set_value(("state", 3), DIRECTION.UP, 100)
+
+    loaded = InternedQTable()
+    loaded.load(path)
+    assert loaded.get_value(("state", 3), DIRECTION.UP) == 3 + DIRECTION.UP / 10
+
+
+def test_dense_table_is_not_loaded(tmp_path):
+    path = str(tmp_path / "table")
+    dense = DenseQTable(16)
+    dense.set_value(3, DIRECTION.UP, 1.0)
+    dense.save(path)
+    for table in (InternedQTable(), QTable()):
+        table.load(path)
+        assert table.get_values(("state", 1), ACTIONS) == {action: 0 for action in ACTIONS}
@@ -0,0 +1,86 @@
+import os
+import random
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+pygame = pytest.importorskip("pygame")
+from game import get_renderer
+from model import DIRECTION, GameState, LEGAL_ACTIONS
+
+BOARD_SIZE = 8
+BLOCK_SIZE = 4
+
+
+def play(draw, seed=5, frames=600):
+    """
+    Plays random games on a small board and draws every frame. Food is also
+    moved without being eaten and one game starts again with the same snake.
+    :param draw: function of snake and food position.
+    :return: number of eaten foods and number of games.
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    game_state = GameState(BOARD_SIZE, BOARD_SIZE)
+    food = game_state.food_spawn.spawn_food(game_state.empty_cells())
+    eaten, games = 0, 1
+    for frame in range(frames):
+        snake = game_state.snake
+        snake.direction = rng.choice(LEGAL_ACTIONS[snake.direction])
+        if snake.move(food):
+            eaten += 1
+            game_state.food_spawn.set_food_on_board(False)
+            food = game_state.food_spawn.spawn_food(game_state.empty_cells())
+        elif frame % 7 == 0:
+            # food moves to another cell
+            game_state.food_spawn.set_food_on_board(False)
+            food = game_state.food_spawn.spawn_food(game_state.empty_cells())
+        draw(snake, food)
+        if snake.check_collision() or food is None:
+            games += 1
+            if games % 3 == 0:
+                # same snake starts again
+                snake.body = [[4, 4], [3, 4], [2, 4]]
+                snake.direction = DIRECTION.RIGHT
+                if not snake.is_occupied(*food):
+                    continue
+            game_state = GameState(BOARD_SIZE, BOARD_SIZE)
+            food = game_state.food_spawn.spawn_food(game_state.empty_cells())
+    return eaten, games
+
+
+def record(renderer):
+    """
+    :param renderer: name of the renderer.
+    :return: colors of cells in every frame, number of eaten foods and games.
+    """
+    window = pygame.display.set_mode((BOARD_SIZE * BLOCK_SIZE, BOARD_SIZE * BLOCK_SIZE))
+    drawer = get_renderer(renderer, window, BOARD_SIZE, BLOCK_SIZE)
+    frames = []
+
+    def draw(snake, food):
+        drawer.draw(snake, food)
+        drawer.show()
+        surface = pygame.display.get_surface()
+        frames.append([tuple(surface.get_at((x * BLOCK_SIZE + BLOCK_SIZE // 2, y * BLOCK_SIZE + BLOCK_SIZE // 2)))
+                       for y in range(BOARD_SIZE) for x in range(BOARD_SIZE)])
+    eaten, games = play(draw)
+    return frames, eaten, games
+
+
+@pytest.fixture(scope="module")
+def display():
+    pygame.display.init()
+    yield
+    pygame.display.quit()
+
+
+@pytest.mark.parametrize("renderer", ["DIRTY", "SURFARRAY"])
+def test_incremental_renderer_matches_full_renderer(display, renderer):
+    if renderer == "SURFARRAY":
+        pytest.importorskip("numpy")
+    expected, eaten, games = record("FULL")
+    assert eaten > 0 and games > 3
+    frames, _, _ = record(renderer)
+    assert len(frames) == len(expected)
+    for frame, (colors, expected_colors) in enumerate(zip(frames, expected)):
+        assert colors == expected_colors, "frame {0}".format(frame)
@@ -0,0 +1,13 @@
+import pytest
+from reinforcement_agents import LinearSchedule
+from train import SharedSchedule
+
+
+def test_shared_schedule_follows_steps_of_all_workers():
+    schedule = SharedSchedule(LinearSchedule(1.0, 0.0, 1000), 4)
+    # other workers are assumed to make as many steps
+    assert schedule.value(50) == pytest.approx(0.8)
+    schedule.synchronize(500, 100)
+    assert schedule.value(100) == pytest.approx(0.5)
+    assert schedule.value(150) == pytest.approx(0.3)
+    assert schedule.value(300) == 0.0
@@ -0,0 +1,34 @@
+from util import PriorityQueue, PriorityQueueWithFunction
+
+
+def pop_all(queue):
+    items = []
+    while not queue.is_empty():
+        items.append(queue.pop())
+    return items
+
+
+def test_update_decreases_priority_by_key():
+    queue = PriorityQueue()
+    queue.update([1, "a"], 5, key=1)
+    queue.update([2, "b"], 3, key=2)
+    queue.update([1, "c"], 1, key=1)
+    queue.update([2, "d"], 4, key=2)
+    assert pop_all(queue) == [[1, "c"], [2, "b"]]
+
+
+def test_update_of_unhashable_items_without_key():
+    queue = PriorityQueue()
+    queue.update([1, "a"], 5)
+    queue.update([2, "b"], 3)
+    queue.update([1, "a"], 1)
+    queue.update([2, "b"], 4)
+    assert pop_all(queue) == [[1, "a"], [2, "b"]]
+
+
+def test_update_of_hashable_items_without_key():
+    queue = PriorityQueueWithFunction(lambda item: item[1])
+    queue.update(("a", 5))
+    queue.update(("b", 3))
+    queue.update(("a", 5))
+    assert pop_all(queue) == [("b", 3), ("a", 5)]